@@ -3,7 +3,6 @@ import os
 import re
 import yt_dlp
 from yt_dlp.utils import DownloadError
-from moviepy.video.io.VideoFileClip import VideoFileClip
 import tempfile
 import logging
 import argparse
@@ -11,22 +10,19 @@ import subprocess
 import shutil
 import json
 from PIL import Image
-import requests # Added for direct image download
+from urllib.parse import urlparse
 import glob
 import time
-
-# Add selenium imports
-try:
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.chrome.service import Service
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.support import expected_conditions as EC
-    from selenium.common.exceptions import TimeoutException, NoSuchElementException
-    SELENIUM_AVAILABLE = True
-except ImportError:
-    SELENIUM_AVAILABLE = False
+from result_cache import ARTIFACT_DIR, get_result_cache, make_cache_key
+from metadata_cache import metadata_cache, cached_extract_info
+from http_downloads import fetch_to_file, fetch_all, get_session, DOWNLOAD_CHUNK_SIZE
+from browser_pool import browser_pool, SELENIUM_AVAILABLE
+from conversion_pool import conversion_pool, run_conversion, ffmpeg_thread_args
+from single_flight import SingleFlight, file_lock, partial_path, publish
+from metrics import stage_timer, record_tier, DOWNLOAD_BYTES, OUTPUT_BYTES
+from progress import ytdlp_progress_hook
+from partial_downloads import partial_area, discard_area, check_manifest, formats_fingerprint
+from tier_router import TierRouter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,6 +31,24 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 TARGET_SIZE_MB = 9.2
 TARGET_SIZE_BYTES = TARGET_SIZE_MB * 1024 * 1024
 IMAGE_FRAME_DURATION = 500 # Milliseconds per frame in image GIF
+STILL_CLONES_PER_FRAME = 2 # Copies of each gallery still per output frame; concat needs more than one per segment
+GIF_TWO_PASS = os.environ.get('GIF_TWO_PASS', '0') == '1' # Legacy palette-file encode, kept for A/B comparison
+STREAM_ENCODE = os.environ.get('STREAM_ENCODE', '1') == '1' # Pipe single-file videos into ffmpeg while downloading
+STREAM_GIF_BYTES_PER_PIXEL = float(os.environ.get('STREAM_GIF_BYTES_PER_PIXEL', 0.2)) # Rough GIF bytes per pixel per frame, to predict stream sizes
+SELENIUM_MEDIA_WAIT_SECONDS = 10 # Upper bound on waiting for <video>/media <img> to appear
+GIF_DITHER = "dither=bayer:bayer_scale=5:diff_mode=rectangle" # paletteuse options shared by ffmpeg encoders
+OUTPUT_FORMATS = {'gif': '.gif', 'webp': '.webp', 'mp4': '.mp4', 'apng': '.png'} # Output format -> file extension
+OUTPUT_MIMETYPES = {'image/gif': 'gif', 'image/webp': 'webp', 'video/mp4': 'mp4', 'image/apng': 'apng'} # For Accept negotiation
+# ffmpeg output options for the non-GIF formats: (final pixel format, muxer/encoder args). All loop forever, like the GIF.
+FORMAT_ENCODERS = {
+    'webp': ('yuv420p', ['-c:v', 'libwebp', '-quality', '75', '-compression_level', '4', '-loop', '0', '-f', 'webp']),
+    'mp4': ('yuv420p', ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+                        '-movflags', '+faststart', '-f', 'mp4']),
+    'apng': ('rgb24', ['-plays', '0', '-f', 'apng']),
+}
+
+tweet_flights = SingleFlight() # Coalesces concurrent process_tweet_url calls for the same GIF
+tweet_router = TierRouter('twitter') # Learns which media tier works for which kind of tweet
 
 # --- Helper Functions ---
 def get_tweet_id(url):
@@ -42,12 +56,110 @@ def get_tweet_id(url):
     match = re.search(r'status/(\d+)', url)
     return match.group(1) if match else None
 
+def guess_image_extension(img_url, content_type):
+    """Picks a file extension from the Content-Type header, falling back to the URL path."""
+    if content_type:
+        mime_type = content_type.split(';')[0].strip()
+        if mime_type == 'image/jpeg': return '.jpg'
+        elif mime_type == 'image/png': return '.png'
+        elif mime_type == 'image/webp': return '.webp'
+        elif mime_type == 'image/gif': return '.gif'
+    try:
+        parsed_ext = os.path.splitext(urlparse(img_url).path)[-1].lower()
+        if parsed_ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
+            return parsed_ext
+    except Exception:
+        pass # Ignore URL parsing errors for extension
+    return '.jpg' # Default
+
+def image_urls_from_info(media_info):
+    """
+    Picks image URLs out of a yt-dlp info dict.
+    Galleries use their entries; single items prefer the direct URL when it
+    has no video codec, then the highest-res thumbnail, then the URL anyway.
+    """
+    entries = media_info.get('entries')
+    if entries:
+        image_urls = [
+            e.get('url') for e in entries
+            if e.get('url') and e.get('vcodec', 'none') == 'none'
+        ]
+        # If no URLs found with vcodec check, try getting all entry URLs
+        if not image_urls:
+            image_urls = [e.get('url') for e in entries if e.get('url')]
+        return image_urls
+
+    img_url = media_info.get('url')
+    thumb_url = None
+    if media_info.get('thumbnails'):
+        thumb_url = media_info['thumbnails'][-1]['url'] # Highest res
+
+    if img_url and media_info.get('vcodec', 'none') == 'none':
+        return [img_url]
+    elif thumb_url:
+        return [thumb_url]
+    elif img_url: # Use URL as last resort even if vcodec wasn't 'none'
+        return [img_url]
+    return []
+
 # Refactored to use requests for image downloads and a revised fallback
-def download_media(url, output_dir):
+def extract_tweet_info(url):
+    """
+    Extracts the tweet's yt-dlp info once (or reuses the metadata cache),
+    so every media tier works from the same result. When yt-dlp finds no
+    video, the tolerant image-fallback extraction runs here as well, once.
+    Returns (media_info, status): status is 'ok', 'no_video' (media_info
+    is whatever the fallback found, possibly None) or 'error'.
+    """
+    tweet_id = get_tweet_id(url)
+    info_opts = {
+        'quiet': True, 'no_warnings': True,
+        'dump_single_json': True, 'noplaylist': True,
+    }
+    logging.info(f"Fetching media info for {url}…")
+    try:
+        with stage_timer('twitter', 'extract'), yt_dlp.YoutubeDL(info_opts) as ydl:
+            media_info = cached_extract_info(ydl, url, f"twitter:{tweet_id}")
+        if not media_info:
+            logging.error("yt-dlp extracted no info.")
+            record_tier('twitter', 'ytdlp', False)
+            return None, 'error'
+        return media_info, 'ok'
+    except DownloadError as e:
+        record_tier('twitter', 'ytdlp', False)
+        err = str(e).lower()
+        if not ("no video" in err or "no media formats found" in err or "could not find tweet" in err):
+            logging.error(f"yt-dlp error during info extraction: {e}")
+            return None, 'error'
+        logging.warning(f"Initial info extraction failed ({e}). Will attempt image-only extraction.")
+    except Exception as e:
+        record_tier('twitter', 'ytdlp', False)
+        logging.error(f"Unexpected info extraction error: {e}")
+        return None, 'error'
+
+    # Re-attempt once, tolerating errors, to find URLs/Thumbnails
+    logging.info("Fallback: Re-attempting info extraction to find image URLs...")
+    fallback_info_opts = dict(info_opts, ignoreerrors=True)
+    media_info_fallback = None
+    try:
+        with stage_timer('twitter', 'extract'), yt_dlp.YoutubeDL(fallback_info_opts) as ydl:
+            media_info_fallback = ydl.extract_info(url, download=False)
+    except DownloadError as fallback_dl_e:
+        # Log specific DownloadError during fallback info extraction but continue
+        logging.warning(f"DownloadError during fallback info extraction (ignored): {fallback_dl_e}")
+    except Exception as fallback_e:
+        # Log other errors during fallback info extraction but continue
+        logging.error(f"Error during fallback info extraction (ignored): {fallback_e}")
+    return media_info_fallback, 'no_video'
+
+
+def download_media(url, output_dir, extracted=None):
     """
     Downloads media (video or images) from the given URL.
     Attempts yt-dlp info extraction first. If only images are present,
     it extracts their URLs and downloads them using requests.
+    extracted is a result of extract_tweet_info to reuse; without it the
+    info is extracted here.
     Returns (media_type, downloaded_paths) or (None, None) on failure.
     """
     tweet_id = get_tweet_id(url)
@@ -59,32 +171,18 @@ def download_media(url, output_dir):
     downloaded_paths = []
     image_urls_to_download = []
     media_info = None
+    media_info_fallback = None
     attempt_image_fallback = False
 
     # --- Step 1: Info extraction ---
-    info_opts = {
-        'quiet': True, 'no_warnings': True,
-        'dump_single_json': True, 'noplaylist': True,
-    }
-    logging.info(f"Fetching media info for {url}…")
-    try:
-        with yt_dlp.YoutubeDL(info_opts) as ydl:
-            media_info = ydl.extract_info(url, download=False)
-            if not media_info:
-                 logging.error("yt-dlp extracted no info.")
-                 return None, None
-
-    except DownloadError as e:
-        err = str(e).lower()
-        if "no video" in err or "no media formats found" in err or "could not find tweet" in err:
-            logging.warning(f"Initial info extraction failed ({e}). Will attempt image-only extraction.")
-            attempt_image_fallback = True
-        else:
-            logging.error(f"yt-dlp error during info extraction: {e}")
-            return None, None
-    except Exception as e:
-        logging.error(f"Unexpected info extraction error: {e}")
+    extracted_info, status = extracted or extract_tweet_info(url)
+    if status == 'error':
         return None, None
+    if status == 'no_video':
+        attempt_image_fallback = True
+        media_info_fallback = extracted_info
+    else:
+        media_info = extracted_info
 
     # NEW: If info extraction did not yield useful info and URL itself ends with common image/gif ext, use it directly.
     if not media_info and url.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.gif')):
@@ -93,6 +191,10 @@ def download_media(url, output_dir):
         image_urls_to_download = [url]
         return media_type, image_urls_to_download
 
+    # Partial data left in output_dir by an earlier attempt is only resumed if it is for the same streams
+    if media_info:
+        check_manifest(output_dir, formats_fingerprint(media_info))
+
     # --- Step 2: Determine type or trigger fallback ---
     if not attempt_image_fallback and media_info:
         # Check formats first for definitive video evidence
@@ -112,38 +214,16 @@ def download_media(url, output_dir):
         else:
             # Assume image if no video evidence found
             media_type = 'image'
-            entries = media_info.get('entries')
-            if entries:
-                # Extract image URLs from entries
-                image_urls_to_download = [
-                    e.get('url') for e in entries
-                    if e.get('url') and e.get('vcodec', 'none') == 'none'
-                ]
-                # If no URLs found with vcodec check, try getting all entry URLs
-                if not image_urls_to_download:
-                     image_urls_to_download = [e.get('url') for e in entries if e.get('url')]
+            image_urls_to_download = image_urls_from_info(media_info)
+            if media_info.get('entries'):
                 logging.info(f"Detected image gallery with {len(image_urls_to_download)} images.")
+            elif image_urls_to_download:
+                logging.info(f"Detected single image URL: {image_urls_to_download[0]}")
             else:
-                # Single item: prioritize URL if vcodec is none, else thumbnail, else URL anyway
-                img_url = media_info.get('url')
-                thumb_url = None
-                if media_info.get('thumbnails'):
-                    thumb_url = media_info['thumbnails'][-1]['url'] # Highest res
-
-                if img_url and media_info.get('vcodec', 'none') == 'none':
-                    image_urls_to_download = [img_url]
-                elif thumb_url:
-                    image_urls_to_download = [thumb_url]
-                elif img_url: # Use URL as last resort even if vcodec wasn't 'none'
-                    image_urls_to_download = [img_url]
-
-                if image_urls_to_download:
-                    logging.info(f"Detected single image URL: {image_urls_to_download[0]}")
-                else:
-                    # If still no URL, trigger fallback
-                    logging.warning("Could not determine single image URL. Attempting fallback.")
-                    attempt_image_fallback = True
-                    media_type = None # Reset media_type to ensure fallback runs fully
+                # If still no URL, trigger fallback
+                logging.warning("Could not determine single image URL. Attempting fallback.")
+                attempt_image_fallback = True
+                media_type = None # Reset media_type to ensure fallback runs fully
 
         # If type is image but no URLs were found, trigger fallback
         if media_type == 'image' and not image_urls_to_download:
@@ -156,6 +236,8 @@ def download_media(url, output_dir):
             logging.warning("Could not determine media type. Attempting fallback.")
             attempt_image_fallback = True
 
+        record_tier('twitter', 'ytdlp', not attempt_image_fallback)
+
     # --- Step 3: Download or Fallback ---
 
     if media_type == 'video':
@@ -166,12 +248,16 @@ def download_media(url, output_dir):
             'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
             'outtmpl': temp_video_path_tmpl,
             'noplaylist': True, 'quiet': True, 'no_warnings': True,
+            'continuedl': True, # Resume .part files left by an interrupted attempt
+            'progress_hooks': [ytdlp_progress_hook()],
         }
         logging.info("Attempting video download via yt-dlp...")
         try:
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Let ydl handle download and find the file
-                res = ydl.extract_info(url, download=True)
+                # Reuse the info dict from Step 1 instead of extracting again;
+                # process_ie_result runs format selection and the download only
+                with stage_timer('twitter', 'download'):
+                    res = ydl.process_ie_result(media_info, download=True)
                 downloaded_file = None
                 # Try finding filepath from requested_downloads (newer yt-dlp)
                 if 'requested_downloads' in res and res['requested_downloads']:
@@ -202,6 +288,7 @@ def download_media(url, output_dir):
         except DownloadError as dl_e:
              # Handle cases where download fails even if info succeeded
              logging.error(f"Error during video download phase via yt-dlp: {dl_e}")
+             metadata_cache.invalidate(f"twitter:{tweet_id}") # Cached media URLs may be dead
              return None, None
         except Exception as e:
             logging.error(f"Unexpected error during video download via yt-dlp: {e}")
@@ -211,53 +298,19 @@ def download_media(url, output_dir):
     elif media_type == 'image' or attempt_image_fallback:
         # --- Image Download (using requests, potentially triggered by fallback) ---
         if attempt_image_fallback and not image_urls_to_download:
-            # Fallback: Re-attempt info extraction focusing on URLs/Thumbnails
-            logging.info("Fallback: Re-attempting info extraction to find image URLs...")
-            fallback_info_opts = {
-                'quiet': True, 'no_warnings': True,
-                'dump_single_json': True, 'noplaylist': True,
-                'ignoreerrors': True,
-            }
-            media_info_fallback = None # Reset
-            try:
-                with yt_dlp.YoutubeDL(fallback_info_opts) as ydl:
-                    media_info_fallback = ydl.extract_info(url, download=False)
-
-                if media_info_fallback:
-                    # Try extracting URLs again with fallback info
-                    entries = media_info_fallback.get('entries')
-                    if entries:
-                        image_urls_to_download = [e.get('url') for e in entries if e.get('url') and e.get('vcodec', 'none') == 'none']
-                        if not image_urls_to_download: # If specific check fails, grab all URLs
-                             image_urls_to_download = [e.get('url') for e in entries if e.get('url')]
-                        logging.info(f"Fallback extracted {len(image_urls_to_download)} potential image URLs from entries.")
-                    else:
-                        # Single item fallback check
-                        img_url = media_info_fallback.get('url')
-                        thumb_url = None
-                        if media_info_fallback.get('thumbnails'):
-                            thumb_url = media_info_fallback['thumbnails'][-1]['url']
-
-                        # Prioritize direct URL if vcodec is none, else thumbnail, else URL
-                        if img_url and media_info_fallback.get('vcodec', 'none') == 'none':
-                            image_urls_to_download = [img_url]
-                        elif thumb_url:
-                            image_urls_to_download = [thumb_url]
-                        elif img_url:
-                            image_urls_to_download = [img_url]
-
-                        if image_urls_to_download:
-                             logging.info(f"Fallback extracted image URL: {image_urls_to_download[0]}")
-                else:
-                    logging.warning("Fallback info extraction yielded no result.")
-
-            except DownloadError as fallback_dl_e:
-                 # Log specific DownloadError during fallback info extraction but continue
-                 logging.warning(f"DownloadError during fallback info extraction (ignored): {fallback_dl_e}")
-            except Exception as fallback_e:
-                # Log other errors during fallback info extraction but continue
-                logging.error(f"Error during fallback info extraction (ignored): {fallback_e}")
-                # Proceed without URLs, will fail below if list is empty
+            if media_info is not None:
+                logging.info("Fallback: Reusing extracted info to look for image URLs...")
+                media_info_fallback = media_info
+
+            if media_info_fallback:
+                image_urls_to_download = image_urls_from_info(media_info_fallback)
+                if media_info_fallback.get('entries'):
+                    logging.info(f"Fallback extracted {len(image_urls_to_download)} potential image URLs from entries.")
+                elif image_urls_to_download:
+                     logging.info(f"Fallback extracted image URL: {image_urls_to_download[0]}")
+            else:
+                logging.warning("Fallback info extraction yielded no result.")
+            record_tier('twitter', 'fallback', bool(image_urls_to_download))
 
         # --- Actual Image Download using Requests ---
         if not image_urls_to_download:
@@ -269,63 +322,42 @@ def download_media(url, output_dir):
             media_type = 'image'
 
         logging.info(f"Attempting image download via requests for {len(image_urls_to_download)} URLs...")
-        # (Keep existing requests download loop)
-        # ... (no changes needed in this block) ...
+        # Validate up front, keeping each URL's original index so file names stay stable
+        valid_urls = []
         for i, img_url in enumerate(image_urls_to_download):
             if not img_url:
                 logging.warning(f"Skipping empty image URL at index {i}.")
                 continue
-            try:
-                # Ensure URL has scheme
-                if not img_url.startswith(('http://', 'https://')):
-                    logging.warning(f"Skipping invalid URL (no scheme): {img_url}")
-                    continue
-
-                response = requests.get(img_url, stream=True, timeout=30)
-                response.raise_for_status()
-
-                content_type = response.headers.get('content-type')
-                ext = '.jpg' # Default
-                # Basic extension guessing
-                if content_type:
-                    mime_type = content_type.split(';')[0].strip()
-                    if mime_type == 'image/jpeg': ext = '.jpg'
-                    elif mime_type == 'image/png': ext = '.png'
-                    elif mime_type == 'image/webp': ext = '.webp'
-                    elif mime_type == 'image/gif': ext = '.gif'
-                else: # Fallback to URL parsing
-                    try:
-                        path_part = requests.utils.urlparse(img_url).path
-                        parsed_ext = os.path.splitext(path_part)[-1]
-                        if parsed_ext and parsed_ext.lower() in ['.jpg', '.jpeg', '.png', '.webp', '.gif']:
-                            ext = parsed_ext.lower()
-                    except Exception:
-                         pass # Ignore URL parsing errors for extension
-
-                temp_image_path = os.path.join(output_dir, f"temp_media_{tweet_id}_{i+1}{ext}")
-
-                with open(temp_image_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-
-                if os.path.exists(temp_image_path) and os.path.getsize(temp_image_path) > 0: # Check size > 0
-                    logging.info(f"Image {i+1} downloaded successfully: {temp_image_path}")
-                    downloaded_paths.append(temp_image_path)
-                else:
-                    logging.warning(f"Image {i+1} download finished but file not found or empty at {temp_image_path}")
-                    if os.path.exists(temp_image_path): # Clean up empty file
-                         try: os.remove(temp_image_path)
-                         except OSError: pass
-
+            # Ensure URL has scheme
+            if not img_url.startswith(('http://', 'https://')):
+                logging.warning(f"Skipping invalid URL (no scheme): {img_url}")
+                continue
+            valid_urls.append((i, img_url))
+
+        def image_path_for(index, response):
+            i, img_url = valid_urls[index]
+            ext = guess_image_extension(img_url, response.headers.get('content-type'))
+            return os.path.join(output_dir, f"temp_media_{tweet_id}_{i+1}{ext}")
+
+        # Fetch the whole gallery in parallel over the pooled session
+        with stage_timer('twitter', 'download'):
+            results = fetch_all([img_url for _, img_url in valid_urls], image_path_for, resume_dir=output_dir)
+        failures = [(valid_urls[index], error) for index, (_, error) in enumerate(results) if error]
+        if failures:
+            for (i, img_url), error in failures:
+                logging.error(f"Error downloading image {i+1} from {img_url}: {error}")
+            # Fail entire process if one image fails; finished images stay in output_dir for the retry
+            return None, None
 
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Error downloading image {i+1} from {img_url}: {e}")
-                # Clean up potentially created file
-                if 'temp_image_path' in locals() and os.path.exists(temp_image_path):
+        for (i, _), (temp_image_path, _) in zip(valid_urls, results):
+            if temp_image_path and os.path.exists(temp_image_path) and os.path.getsize(temp_image_path) > 0: # Check size > 0
+                logging.info(f"Image {i+1} downloaded successfully: {temp_image_path}")
+                downloaded_paths.append(temp_image_path)
+            else:
+                logging.warning(f"Image {i+1} download finished but file not found or empty at {temp_image_path}")
+                if temp_image_path and os.path.exists(temp_image_path): # Clean up empty file
                      try: os.remove(temp_image_path)
                      except OSError: pass
-                # Fail entire process if one image fails
-                return None, None
 
         if not downloaded_paths:
              logging.error("Image download process (requests) completed, but no images were successfully saved.")
@@ -363,38 +395,65 @@ def download_media(url, output_dir):
     return media_type, downloaded_paths
 
 
+def iter_gif_frames(image_paths, width=640, max_height=None):
+    """
+    Yields GIF-ready frames one at a time: each image is decoded (JPEGs at
+    reduced scale via draft), converted to RGB, fitted within `width` x
+    `max_height` (default: width) without upscaling, centered on a common
+    canvas, and quantized to a palette before the next is opened.
+    Only one full-size decoded image is alive at any moment.
+    """
+    max_height = max_height or width
+    # Common canvas from headers only; Image.open doesn't decode pixels
+    fitted_sizes = []
+    for p in image_paths:
+        with Image.open(p) as img:
+            w, h = img.size
+        scale = min(1.0, width / w, max_height / h) # Like the ffmpeg path, never larger than native
+        fitted_sizes.append((max(1, round(w * scale)), max(1, round(h * scale))))
+    canvas_w = max(w for w, _ in fitted_sizes)
+    canvas_h = max(h for _, h in fitted_sizes)
+
+    for p, fitted in zip(image_paths, fitted_sizes):
+        with Image.open(p) as img:
+            img.draft('RGB', fitted) # JPEG: let the decoder downscale by 1/2, 1/4 or 1/8
+            frame = img.convert('RGB')
+        if frame.size != fitted:
+            frame = frame.resize(fitted, Image.LANCZOS)
+        canvas = Image.new('RGB', (canvas_w, canvas_h))
+        canvas.paste(frame, ((canvas_w - fitted[0]) // 2, (canvas_h - fitted[1]) // 2))
+        frame.close()
+        yield canvas.quantize(colors=256)
+        canvas.close()
+
 # New function to convert images to GIF
-def convert_images_to_gif(image_paths, gif_path):
-    """Converts a list of images to an animated GIF using Pillow."""
+def convert_images_to_gif(image_paths, gif_path, width=640):
+    """
+    Converts a list of images to an animated GIF using Pillow.
+    Frames are streamed through iter_gif_frames, so peak memory stays near
+    one decoded image instead of the whole gallery at full resolution.
+    """
     if not image_paths:
         logging.error("No image paths provided for GIF conversion.")
         return None
 
     try:
-        images = [Image.open(p) for p in image_paths]
-        # Ensure all images are in RGBA or RGB for consistency if needed
-        # images = [img.convert("RGBA") for img in images]
+        frames = iter_gif_frames(image_paths, width=width)
+        first_frame = next(frames, None)
 
-        if not images:
+        if first_frame is None:
             logging.error("Could not open any images.")
             return None
 
-        first_image = images[0]
-        subsequent_frames = images[1:]
-
-        first_image.save(
+        first_frame.save(
             gif_path,
             save_all=True,
-            append_images=subsequent_frames,
+            append_images=frames, # Consumed lazily while writing
             duration=IMAGE_FRAME_DURATION, # Duration per frame in ms
             loop=0  # Loop forever
         )
         logging.info(f"Image GIF created successfully: {gif_path}")
 
-        # Close images
-        for img in images:
-            img.close()
-
         return gif_path
     except Exception as e:
         logging.exception(f"Error converting images to GIF: {e}")
@@ -406,29 +465,378 @@ def convert_images_to_gif(image_paths, gif_path):
                 pass
         return None
 
-# Remove the compress_gif function and replace with a stub that always returns True
-def compress_gif(gif_path):
-    """Placeholder function - no compression is performed."""
+def image_sequence_graph(image_paths, fps=10, durations=None):
+    """
+    Builds ffmpeg inputs and a filter graph that play image_paths as one
+    stream on a common canvas (see convert_images_to_gif_ffmpeg). Images
+    play in sorted path order; durations[i] belongs to image_paths[i].
+    Durations are rounded to whole output frames.
+    Returns (input_args, filters), or (None, None) on failure.
+    """
+    if durations and len(durations) != len(image_paths):
+        logging.error("Need exactly one duration per image for FFmpeg image conversion.")
+        return None, None
+    # Sort the images, keeping each one's duration with it
+    pairs = sorted(zip(image_paths, durations or [None] * len(image_paths)), key=lambda pair: pair[0])
+    image_paths = [path for path, _ in pairs]
+
+    # Determine frame rate based on number of images
+    # Use slow frame rate for few images, faster for many
+    if len(image_paths) <= 2:
+        adjusted_fps = 1  # Very slow for 1-2 images
+    elif len(image_paths) <= 5:
+        adjusted_fps = 2  # Slow for 3-5 images
+    else:
+        adjusted_fps = fps  # Default for 6+ images
+
+    if durations:
+        durations = [duration for _, duration in pairs]
+        output_fps = 10 # 0.1 s resolution for per-frame durations
+    else:
+        durations = [1.0 / adjusted_fps] * len(image_paths)
+        output_fps = adjusted_fps
+
+    # Common canvas: the largest image, read from headers only
+    try:
+        sizes = []
+        for img_path in image_paths:
+            with Image.open(img_path) as img:
+                sizes.append(img.size)
+    except Exception as e:
+        logging.error(f"Could not read image dimensions for FFmpeg image conversion: {e}")
+        return None, None
+    canvas_w = max(w for w, _ in sizes) // 2 * 2
+    canvas_h = max(h for _, h in sizes) // 2 * 2
+
+    input_args = []
+    chains = []
+    for i, (img_path, duration) in enumerate(zip(image_paths, durations)):
+        input_args += ['-i', img_path]
+        # A still decodes to one frame, and concat collapses single-frame segments to pts 0.
+        # So each image is cloned to two frames per output frame, timestamped by frame
+        # number, and every other frame of the joined stream is kept after concat. The fps
+        # filter then only stamps the rate, passing the last image through at EOF
+        clones = STILL_CLONES_PER_FRAME * max(1, round(duration * output_fps))
+        chains.append(
+            f"[{i}:v]scale={canvas_w}:{canvas_h}:force_original_aspect_ratio=decrease,"
+            f"pad={canvas_w}:{canvas_h}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+            f"loop=loop={clones - 1}:size=1:start=0,"
+            f"setpts=N/({output_fps * STILL_CLONES_PER_FRAME}*TB)[v{i}]"
+        )
+    labels = ''.join(f"[v{i}]" for i in range(len(image_paths)))
+    filters = (';'.join(chains) + f";{labels}concat=n={len(image_paths)}:v=1:a=0,"
+               f"select='not(mod(n\\,{STILL_CLONES_PER_FRAME}))',setpts=N/({output_fps}*TB),"
+               f"fps={output_fps}:round=down:eof_action=pass,format=rgb24")
+    return input_args, filters
+
+def convert_images_to_gif_ffmpeg(image_paths, gif_path, fps=10, two_pass=GIF_TWO_PASS, durations=None):
+    """
+    Converts a sequence of images to an animated GIF using ffmpeg with palette optimization.
+    This offers better quality than the PIL-based method.
+    Each image is its own looped ffmpeg input, so files are read in place
+    (no sequence copies), mixed formats and sizes work, and every frame can
+    have its own duration in seconds via durations.
+    Like convert_to_gif_ffmpeg, runs a single invocation unless two_pass=True.
+    """
+    if not image_paths:
+        logging.error("No image paths provided for FFmpeg GIF conversion.")
+        return None
+
+    input_args, filters = image_sequence_graph(image_paths, fps=fps, durations=durations)
+    if input_args is None:
+        return None
+
+    if not two_pass:
+        # Per-frame palettes (stats_mode=single) need paletteuse new=1 to be applied
+        return run_ffmpeg_single_pass(
+            input_args, filters, gif_path,
+            palettegen='palettegen=stats_mode=single',
+            paletteuse=f"paletteuse={GIF_DITHER}:new=1"
+        )
+
+    with tempfile.TemporaryDirectory() as temp_palette_dir:
+        palette_path = os.path.join(temp_palette_dir, "palette.png")
+
+        # Step 1: Create palette. One palette for the whole gallery: stats_mode=single
+        # would emit one per frame, and the image2 muxer refuses to write a second file
+        palette_cmd = [
+            'ffmpeg', *ffmpeg_thread_args(),
+            *input_args,
+            '-filter_complex', f"{filters},palettegen",
+            '-y', palette_path
+        ]
+
+        logging.info(f"Generating palette for image sequence: {' '.join(palette_cmd)}")
+
+        try:
+            subprocess.run(palette_cmd, check=True, capture_output=True)
+
+            if not os.path.exists(palette_path):
+                logging.error("Failed to generate palette for image sequence.")
+                return None
+
+            # Step 2: Convert using palette
+            convert_cmd = [
+                'ffmpeg', *ffmpeg_thread_args(),
+                *input_args,
+                '-i', palette_path,
+                '-filter_complex', f"{filters}[x];[x][{len(image_paths)}:v]paletteuse={GIF_DITHER}",
+                '-y', gif_path
+            ]
+
+            logging.info(f"Creating GIF from image sequence: {' '.join(convert_cmd)}")
+
+            subprocess.run(convert_cmd, check=True, capture_output=True)
+
+            if os.path.exists(gif_path):
+                logging.info(f"FFmpeg image-to-GIF created successfully: {gif_path}")
+                return gif_path
+            else:
+                logging.error("FFmpeg image-to-GIF conversion failed: output file not found.")
+                return None
+
+        except subprocess.CalledProcessError as e:
+            logging.error(f"FFmpeg error during image-to-GIF conversion: {e}")
+            if e.stderr:
+                logging.error(f"FFmpeg stderr: {e.stderr.decode()}")
+            if os.path.exists(gif_path):
+                try:
+                    os.remove(gif_path)
+                except OSError:
+                    pass
+            return None
+        except FileNotFoundError:
+            logging.error("FFmpeg command not found. Ensure FFmpeg is installed and in your PATH.")
+            return None
+
+# --- Size targeting ---
+# Rough relative output size for each knob, used to rank candidates before
+# any sample is encoded. Sample encodes then calibrate the absolute numbers.
+PALETTE_SIZE_FACTORS = {256: 1.0, 128: 0.85, 64: 0.72}
+LOSSY_SIZE_FACTORS = {0: 1.0, 30: 0.75, 80: 0.55}
+SIZE_SAMPLE_SECONDS = 2.0 # Length of the sample encode used for prediction
+SIZE_TARGET_MARGIN = 0.95 # Aim a little under the target so prediction error doesn't overshoot
+MAX_FULL_ENCODES = 3
+
+def probe_media(path):
+    """
+    Returns (duration_seconds, width, fps) of the first video stream via
+    ffprobe; unknown values are None.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'format=duration:stream=width,avg_frame_rate',
+        '-of', 'json', path
+    ]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True)
+        data = json.loads(result.stdout.decode() or '{}')
+        duration = float(data.get('format', {}).get('duration') or 0) or None
+        stream = (data.get('streams') or [{}])[0]
+        fps = None
+        num, _, den = (stream.get('avg_frame_rate') or '').partition('/')
+        if num and den and float(den):
+            fps = float(num) / float(den) or None
+        return duration, stream.get('width'), fps
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+        logging.warning(f"ffprobe could not read {path}: {e}")
+        return None, None, None
+
+def apply_lossy(gif_path, lossy):
+    """Runs gifsicle's lossy LZW compression in place. Returns True on success."""
+    if not lossy:
+        return True
+    cmd = ['gifsicle', '-O3', f'--lossy={lossy}', '-b', gif_path]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        logging.warning(f"gifsicle lossy pass failed: {e}")
+        return False
+
+def size_candidates(fps, width):
+    """
+    All (fps, width, max_colors, lossy) combinations at or below the requested
+    quality, best first, each with its modelled size relative to the request.
+    """
+    fps_options = sorted({f for f in (fps, 12, 10, 8) if f <= fps}, reverse=True)
+    width_options = sorted({w for w in (width, 540, 480, 400, 320, 240) if w <= width}, reverse=True)
+    lossy_options = sorted(LOSSY_SIZE_FACTORS) if shutil.which('gifsicle') else [0]
+    candidates = []
+    for f in fps_options:
+        for w in width_options:
+            for colors in sorted(PALETTE_SIZE_FACTORS, reverse=True):
+                for lossy in lossy_options:
+                    factor = (f / fps) * (w / width) ** 2 * PALETTE_SIZE_FACTORS[colors] * LOSSY_SIZE_FACTORS[lossy]
+                    candidates.append(({'fps': f, 'width': w, 'max_colors': colors, 'lossy': lossy}, factor))
+    candidates.sort(key=lambda c: c[1], reverse=True)
+    return candidates
+
+def encode_gif_candidate(source_path, gif_path, params, start=None, seconds=None):
+    """Encodes source_path (optionally just a window of it) with one candidate's settings."""
+    input_args = []
+    if start is not None:
+        input_args += ['-ss', f"{start:.2f}"]
+    if seconds is not None:
+        input_args += ['-t', f"{seconds:.2f}"]
+    input_args += ['-i', source_path]
+    filters = f"fps={params['fps']},scale={params['width']}:-1:flags=lanczos"
+    result = run_ffmpeg_single_pass(input_args, filters, gif_path,
+                                    palettegen=f"palettegen=max_colors={params['max_colors']}")
+    if result and not apply_lossy(result, params['lossy']):
+        return None
+    return result
+
+def convert_to_gif_target_size(source_path, gif_path, fps=15, width=640, target_bytes=TARGET_SIZE_BYTES):
+    """
+    Encodes source_path (a video or an existing GIF) to gif_path, picking
+    fps, width, palette size and lossy level so the result lands under target_bytes.
+
+    Candidate sizes are modelled from a short sample encode scaled by
+    duration, then corrected by every sample/full encode actually run, so
+    most inputs need only one full encode.
+    If MAX_FULL_ENCODES runs out while still over the target, the smallest
+    candidate is encoded as a last resort. chosen_params['target_met']
+    says whether the result actually fits.
+    Returns (gif_path, chosen_params) or (None, None) on failure.
+    """
+    duration, source_width, source_fps = probe_media(source_path)
+    if source_width:
+        width = min(width, source_width) # Never spend bytes upscaling
+    if source_fps:
+        fps = max(1, min(fps, round(source_fps))) # Nor duplicating frames
+    candidates = size_candidates(fps, width)
+    base_params = candidates[0][0]
+
+    with tempfile.TemporaryDirectory() as sample_dir:
+        sample_path = os.path.join(sample_dir, 'sample.gif')
+        # Predict the full-quality size from a sample taken mid-clip
+        if duration and duration > SIZE_SAMPLE_SECONDS * 1.5:
+            start = max(0.0, duration / 2 - SIZE_SAMPLE_SECONDS / 2)
+            if not encode_gif_candidate(source_path, sample_path, base_params, start=start, seconds=SIZE_SAMPLE_SECONDS):
+                return None, None
+            base_bytes = os.path.getsize(sample_path) * (duration / SIZE_SAMPLE_SECONDS)
+        else:
+            base_bytes = None # Short clip: a full encode is as cheap as a sample
+
+        calibration = 1.0 # actual / modelled size, learned from encodes we run
+        budget = target_bytes * SIZE_TARGET_MARGIN
+        index = 0
+        chosen = None
+        for attempt in range(MAX_FULL_ENCODES):
+            # Pick the best candidate the model believes will fit
+            if base_bytes:
+                while index < len(candidates) - 1 and base_bytes * candidates[index][1] * calibration > budget:
+                    index += 1
+            params, factor = candidates[index]
+            logging.info(f"Size target attempt {attempt + 1}: {params} (predicted "
+                         f"{(base_bytes or 0) * factor * calibration / (1024*1024):.2f} MB)")
+            if not encode_gif_candidate(source_path, gif_path, params):
+                return None, None
+            actual = os.path.getsize(gif_path)
+            chosen = dict(params, size=actual)
+            if actual <= target_bytes:
+                break
+            if index == len(candidates) - 1:
+                logging.warning("Smallest candidate still exceeds the size target; keeping it.")
+                break
+            if base_bytes:
+                calibration = actual / (base_bytes * factor)
+            else:
+                base_bytes, calibration = actual / factor, 1.0
+            index += 1
+
+        if chosen['size'] > target_bytes and index < len(candidates) - 1:
+            # Out of attempts while still too big: settle for the smallest settings rather than the last guess
+            params = candidates[-1][0]
+            logging.warning(f"Size target not reached in {MAX_FULL_ENCODES} encodes; "
+                            f"falling back to the smallest settings {params}")
+            if not encode_gif_candidate(source_path, gif_path, params):
+                return None, None
+            chosen = dict(params, size=os.path.getsize(gif_path))
+
+    chosen['target_met'] = chosen['size'] <= target_bytes
+    summary = (f"Size target {target_bytes / (1024*1024):.2f} MB: picked fps={chosen['fps']}, "
+               f"width={chosen['width']}, max_colors={chosen['max_colors']}, lossy={chosen['lossy']} "
+               f"-> {chosen['size'] / (1024*1024):.2f} MB")
+    if chosen['target_met']:
+        logging.info(summary)
+    else:
+        logging.warning(f"{summary} (still over the target)")
+    return gif_path, chosen
+
+def compress_gif(gif_path, target_bytes=TARGET_SIZE_BYTES):
+    """
+    Re-encodes gif_path in place if it is larger than target_bytes.
+    Returns True if the GIF is (now) within the target.
+    """
     if not gif_path or not os.path.exists(gif_path):
         logging.error(f"GIF path is invalid or file not found: {gif_path}")
         return False
-    
-    # Log the original size for information only
+
     original_size = os.path.getsize(gif_path)
-    logging.info(f"GIF size: {original_size / (1024*1024):.2f} MB (compression disabled)")
-    
-    return True  # Always return success since compression is disabled
+    logging.info(f"GIF size: {original_size / (1024*1024):.2f} MB (target {target_bytes / (1024*1024):.2f} MB)")
+    if original_size <= target_bytes:
+        return True
+
+    compressed_path = os.path.splitext(gif_path)[0] + "_compressed.gif"
+    # Start from the GIF's own fps/width; convert_to_gif_target_size caps to the source
+    result, params = convert_to_gif_target_size(gif_path, compressed_path, fps=15,
+                                                width=4096, target_bytes=target_bytes)
+    if not result:
+        if os.path.exists(compressed_path): os.remove(compressed_path)
+        return False
+    os.replace(compressed_path, gif_path)
+    return params['target_met']
 
-def convert_to_gif_ffmpeg(video_path, gif_path, fps=15, width=480):
-    """Converts video to GIF using ffmpeg for potentially better quality."""
-    palette_path = os.path.splitext(gif_path)[0] + "_palette.png"
-    
+def run_ffmpeg_single_pass(input_args, filters, gif_path, palettegen='palettegen', paletteuse=f"paletteuse={GIF_DITHER}"):
+    """
+    Generates and applies the palette inside one filter graph, so the source
+    is decoded and scaled once and no palette file is written.
+    Returns gif_path on success, None on failure.
+    """
+    ffmpeg_cmd = [
+        'ffmpeg', *ffmpeg_thread_args(),
+        *input_args,
+        '-filter_complex', f"{filters},split[a][b];[a]{palettegen}[p];[b][p]{paletteuse}",
+        '-y',
+        gif_path
+    ]
+    logging.info(f"Converting in a single pass: {' '.join(ffmpeg_cmd)}")
+    try:
+        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+        if os.path.exists(gif_path):
+             logging.info(f"FFmpeg GIF created successfully: {gif_path}")
+             return gif_path
+        else:
+             logging.error("FFmpeg conversion finished but GIF file not found.")
+             return None
+    except subprocess.CalledProcessError as e:
+        logging.error(f"ffmpeg conversion failed: {e}")
+        logging.error(f"Stderr: {e.stderr.decode()}")
+        if os.path.exists(gif_path): os.remove(gif_path)
+        return None
+    except FileNotFoundError:
+        logging.error("ffmpeg command not found. Ensure ffmpeg is installed and in your PATH.")
+        return None
+
+def convert_to_gif_ffmpeg(video_path, gif_path, fps=15, width=480, two_pass=GIF_TWO_PASS):
+    """
+    Converts video to GIF using ffmpeg for potentially better quality.
+    By default the palette is built and applied in one invocation; pass
+    two_pass=True for the older palette-file flow (useful for A/B quality checks).
+    """
     # Add vf filter for scaling and fps
     filters = f"fps={fps},scale={width}:-1:flags=lanczos"
 
+    if not two_pass:
+        return run_ffmpeg_single_pass(['-i', video_path], filters, gif_path)
+
+    palette_path = os.path.splitext(gif_path)[0] + "_palette.png"
+
     # Pass 1: Generate palette
     ffmpeg_cmd_palette = [
-        'ffmpeg',
+        'ffmpeg', *ffmpeg_thread_args(),
         '-i', video_path,
         '-vf', f"{filters},palettegen",
         '-y', # Overwrite output file if it exists
@@ -448,10 +856,10 @@ def convert_to_gif_ffmpeg(video_path, gif_path, fps=15, width=480):
 
     # Pass 2: Convert using palette
     ffmpeg_cmd_convert = [
-        'ffmpeg',
+        'ffmpeg', *ffmpeg_thread_args(),
         '-i', video_path,
         '-i', palette_path,
-        '-lavfi', f"{filters} [x]; [x][1:v] paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle", # Experiment with dither options
+        '-lavfi', f"{filters} [x]; [x][1:v] paletteuse={GIF_DITHER}", # Experiment with dither options
         '-y',
         gif_path
     ]
@@ -477,10 +885,162 @@ def convert_to_gif_ffmpeg(video_path, gif_path, fps=15, width=480):
         if os.path.exists(palette_path): os.remove(palette_path)
         return None
 
+# --- Streaming encode ---
+STREAM_PROTOCOLS = ('http', 'https') # Single-file formats ffmpeg can read from a pipe
+
+def convert_to_format_ffmpeg(media_paths, output_path, output_format, fps=15, width=640, images=False):
+    """
+    Encodes a video (one path) or an image sequence (images=True) to a
+    looping animated WebP, H.264 MP4 or APNG (see FORMAT_ENCODERS).
+    These keep full colour, so there is no palette step.
+    Returns output_path on success, None on failure.
+    """
+    if output_format not in FORMAT_ENCODERS:
+        logging.error(f"Unsupported output format for ffmpeg: {output_format}")
+        return None
+    pix_fmt, encoder_args = FORMAT_ENCODERS[output_format]
+
+    if images:
+        input_args, filters = image_sequence_graph(media_paths, fps=fps)
+        if input_args is None:
+            return None
+        # The canvas is already even-sized, which libx264 requires
+        filters += f",format={pix_fmt}"
+    else:
+        input_args = ['-i', media_paths[0]]
+        # -2 keeps the height even; the width must be even too for yuv420p H.264
+        width = max(2, width // 2 * 2)
+        filters = f"fps={fps},scale={width}:-2:flags=lanczos,format={pix_fmt}"
+
+    ffmpeg_cmd = [
+        'ffmpeg', *ffmpeg_thread_args(),
+        *input_args,
+        '-filter_complex', filters,
+        '-an', *encoder_args,
+        '-y',
+        output_path
+    ]
+    logging.info(f"Converting to {output_format}: {' '.join(ffmpeg_cmd)}")
+    try:
+        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+        if os.path.exists(output_path):
+            logging.info(f"FFmpeg {output_format} created successfully: {output_path}")
+            return output_path
+        logging.error(f"FFmpeg conversion finished but {output_format} file not found.")
+        return None
+    except subprocess.CalledProcessError as e:
+        logging.error(f"ffmpeg {output_format} conversion failed: {e}")
+        logging.error(f"Stderr: {e.stderr.decode()}")
+        if os.path.exists(output_path): os.remove(output_path)
+        return None
+    except FileNotFoundError:
+        logging.error("ffmpeg command not found. Ensure ffmpeg is installed and in your PATH.")
+        return None
+
+def select_streamable_format(media_info):
+    """
+    Picks the best single-file video format (no DASH/HLS merge) from a yt-dlp
+    info dict, preferring mp4. Returns the format dict or None.
+    """
+    formats = [
+        f for f in (media_info.get('formats') or [])
+        if f.get('url') and f.get('vcodec', 'none') != 'none'
+        and f.get('protocol', 'https') in STREAM_PROTOCOLS
+    ]
+    if not formats:
+        return None
+    return max(formats, key=lambda f: (f.get('ext') == 'mp4', f.get('height') or 0, f.get('tbr') or 0))
+
+def stream_to_gif_ffmpeg(media_url, gif_path, fps=15, width=640, headers=None):
+    """
+    Pipes media bytes into ffmpeg as they arrive, so encoding overlaps the
+    download and no copy of the video is staged on disk.
+    Only works for containers ffmpeg can read without seeking (e.g. faststart mp4).
+    Returns gif_path on success, None on failure.
+    """
+    filters = f"fps={fps},scale={width}:-1:flags=lanczos"
+    ffmpeg_cmd = [
+        'ffmpeg', *ffmpeg_thread_args(),
+        '-i', 'pipe:0',
+        '-filter_complex', f"{filters},split[a][b];[a]palettegen[p];[b][p]paletteuse={GIF_DITHER}",
+        '-y',
+        gif_path
+    ]
+    logging.info(f"Streaming {media_url} into: {' '.join(ffmpeg_cmd)}")
+    try:
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            try:
+                with get_session().get(media_url, stream=True, timeout=30, headers=headers) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        proc.stdin.write(chunk)
+            except BrokenPipeError:
+                pass # ffmpeg exited early; its return code tells us why
+            except Exception:
+                proc.kill()
+                proc.wait()
+                raise
+            finally:
+                try: proc.stdin.close()
+                except BrokenPipeError: pass
+            returncode = proc.wait()
+            if returncode != 0:
+                stderr_file.seek(0)
+                logging.error(f"Streaming ffmpeg encode failed ({returncode}): {stderr_file.read().decode(errors='replace')[-2000:]}")
+                if os.path.exists(gif_path): os.remove(gif_path)
+                return None
+    except FileNotFoundError:
+        logging.error("ffmpeg command not found. Ensure ffmpeg is installed and in your PATH.")
+        return None
+    except Exception as e:
+        logging.error(f"Streaming download failed: {e}")
+        if os.path.exists(gif_path): os.remove(gif_path)
+        return None
+
+    if os.path.exists(gif_path):
+        logging.info(f"FFmpeg GIF created from stream: {gif_path}")
+        return gif_path
+    logging.error("Streaming ffmpeg encode finished but GIF file not found.")
+    return None
+
+def stream_overshoots(media_info, fps=15, width=640, target_bytes=TARGET_SIZE_BYTES):
+    """
+    True if a stream encode of media_info is predicted to exceed target_bytes.
+    The stream tier can't search sizes, so such videos go to the download
+    path, whose size search encodes once instead of encoding twice.
+    """
+    fmt = select_streamable_format(media_info)
+    duration = media_info.get('duration')
+    if not target_bytes or not fmt or not duration:
+        return False
+    aspect = (fmt['height'] / fmt['width']) if fmt.get('width') and fmt.get('height') else 9 / 16
+    predicted = duration * fps * width * width * aspect * STREAM_GIF_BYTES_PER_PIXEL
+    if predicted <= target_bytes:
+        return False
+    logging.info(f"Stream GIF predicted at {predicted / (1024*1024):.1f} MB, over the "
+                 f"{target_bytes / (1024*1024):.1f} MB target; using the download path.")
+    return True
+
+def stream_tweet_video_to_gif(media_info, gif_path, fps=15, width=640):
+    """
+    Encodes a video tweet straight from its media URL when a single-file
+    format exists in media_info (from extract_tweet_info). Returns gif_path,
+    or None so the caller falls back to download_media.
+    """
+    fmt = select_streamable_format(media_info)
+    if not fmt:
+        logging.info("No single-file video format to stream; using the download path.")
+        return None
+    # The encode runs in this process (it is fed by our download), but still takes a conversion slot
+    with conversion_pool.slot():
+        return stream_to_gif_ffmpeg(fmt['url'], gif_path, fps=fps, width=width, headers=fmt.get('http_headers'))
+
 # Keep the original convert_to_gif as fallback
 def convert_to_gif(video_path, gif_path):
     """Legacy conversion method using MoviePy. Used as fallback if ffmpeg fails."""
     try:
+        from moviepy.video.io.VideoFileClip import VideoFileClip # Imported here: only this fallback needs MoviePy
         clip = VideoFileClip(video_path)
         clip.write_gif(gif_path, fps=15) # Increased FPS for smoother motion
         clip.close()
@@ -518,6 +1078,9 @@ def extract_media_with_selenium(url, output_dir):
     if not SELENIUM_AVAILABLE:
         logging.error("Selenium not available. Cannot use browser-based extraction.")
         return None, None
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException
     
     tweet_id = get_tweet_id(url)
     if not tweet_id:
@@ -526,160 +1089,133 @@ def extract_media_with_selenium(url, output_dir):
     
     logging.info("Attempting direct browser-based media extraction with Selenium...")
     
-    # Setup Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")  # Run in headless mode
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--window-size=1920,1080")
-    
-    driver = None
     media_type = None
     downloaded_paths = []
     
     try:
-        # Initialize browser
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.get(url)
-        
-        # Wait for page to load
-        time.sleep(5)  # Simple wait for page content
+        # Borrow a warm browser from the pool instead of launching Chrome per request
+        with browser_pool.session() as driver:
+            driver.get(url)
+
+            # Wait until the tweet's media is present instead of a fixed sleep
+            try:
+                WebDriverWait(driver, SELENIUM_MEDIA_WAIT_SECONDS).until(
+                    lambda d: d.find_elements(By.TAG_NAME, "video")
+                    or d.find_elements(By.CSS_SELECTOR, 'img[src*="pbs.twimg.com/media"]')
+                )
+            except TimeoutException:
+                logging.warning(f"No media element appeared within {SELENIUM_MEDIA_WAIT_SECONDS}s; scraping page as-is.")
         
-        # Try to find video elements first
-        video_elements = driver.find_elements(By.TAG_NAME, "video")
-        if video_elements:
-            logging.info(f"Found {len(video_elements)} video elements on page.")
-            media_type = 'video'
+            # Try to find video elements first
+            video_elements = driver.find_elements(By.TAG_NAME, "video")
+            if video_elements:
+                logging.info(f"Found {len(video_elements)} video elements on page.")
+                media_type = 'video'
             
-            # Get the source of the first video
-            video_url = None
-            for video in video_elements:
-                # Try to get direct src
-                video_url = video.get_attribute("src")
-                if not video_url:
-                    # Try to get source from child source elements
-                    source_elements = video.find_elements(By.TAG_NAME, "source")
-                    if source_elements:
-                        video_url = source_elements[0].get_attribute("src")
+                # Get the source of the first video
+                video_url = None
+                for video in video_elements:
+                    # Try to get direct src
+                    video_url = video.get_attribute("src")
+                    if not video_url:
+                        # Try to get source from child source elements
+                        source_elements = video.find_elements(By.TAG_NAME, "source")
+                        if source_elements:
+                            video_url = source_elements[0].get_attribute("src")
                 
-                if video_url:
-                    logging.info(f"Found video URL: {video_url}")
-                    break
+                    if video_url:
+                        logging.info(f"Found video URL: {video_url}")
+                        break
             
-            if video_url:
-                # Download the video
-                temp_video_path = os.path.join(output_dir, f"temp_media_{tweet_id}.mp4")
+                if video_url:
+                    # Download the video
+                    temp_video_path = os.path.join(output_dir, f"temp_media_{tweet_id}.mp4")
                 
-                try:
-                    # Use requests to download the video
-                    response = requests.get(video_url, stream=True, timeout=30, 
-                                          headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"})
-                    with open(temp_video_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
+                    try:
+                        # Use the pooled session to download the video
+                        fetch_to_file(video_url, lambda response: temp_video_path,
+                                      headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
+                                      resume_dir=output_dir)
                     
-                    if os.path.exists(temp_video_path) and os.path.getsize(temp_video_path) > 0:
-                        logging.info(f"Video downloaded successfully via Selenium extraction: {temp_video_path}")
-                        downloaded_paths.append(temp_video_path)
-                    else:
-                        logging.error("Video download via Selenium finished but file is empty or missing.")
-                except Exception as download_err:
-                    logging.error(f"Error downloading video with Selenium URL: {download_err}")
-                    return None, None
-        else:
-            # No videos, try to find images
-            image_elements = driver.find_elements(By.TAG_NAME, "img")
-            if image_elements:
-                media_type = 'image'
-                logging.info(f"Found {len(image_elements)} image elements on page.")
+                        if os.path.exists(temp_video_path) and os.path.getsize(temp_video_path) > 0:
+                            logging.info(f"Video downloaded successfully via Selenium extraction: {temp_video_path}")
+                            downloaded_paths.append(temp_video_path)
+                        else:
+                            logging.error("Video download via Selenium finished but file is empty or missing.")
+                    except Exception as download_err:
+                        logging.error(f"Error downloading video with Selenium URL: {download_err}")
+                        return None, None
+            else:
+                # No videos, try to find images
+                image_elements = driver.find_elements(By.TAG_NAME, "img")
+                if image_elements:
+                    media_type = 'image'
+                    logging.info(f"Found {len(image_elements)} image elements on page.")
                 
-                # Filter out small icons and get unique image URLs with good size
-                image_urls = []
-                processed_urls = set()
+                    # Filter out small icons and get unique image URLs with good size
+                    image_urls = []
+                    processed_urls = set()
                 
-                for img in image_elements:
-                    img_url = img.get_attribute("src")
+                    for img in image_elements:
+                        img_url = img.get_attribute("src")
                     
-                    # Process only if URL exists and hasn't been seen
-                    if img_url and img_url not in processed_urls:
-                        processed_urls.add(img_url)
+                        # Process only if URL exists and hasn't been seen
+                        if img_url and img_url not in processed_urls:
+                            processed_urls.add(img_url)
                         
-                        # Skip small images (likely icons, avatars)
-                        try:
-                            width = int(img.get_attribute("width") or 0)
-                            height = int(img.get_attribute("height") or 0)
-                            if width < 100 or height < 100:
-                                continue
-                        except (ValueError, TypeError):
-                            # If we can't determine size, include it anyway
-                            pass
+                            # Skip small images (likely icons, avatars)
+                            try:
+                                width = int(img.get_attribute("width") or 0)
+                                height = int(img.get_attribute("height") or 0)
+                                if width < 100 or height < 100:
+                                    continue
+                            except (ValueError, TypeError):
+                                # If we can't determine size, include it anyway
+                                pass
                         
-                        # Check if URL is a data URL and skip if it is
-                        if img_url.startswith("data:"):
-                            continue
+                            # Check if URL is a data URL and skip if it is
+                            if img_url.startswith("data:"):
+                                continue
                             
-                        # Check if it's likely the main tweet image
-                        if "twimg" in img_url and ("media" in img_url or "pbs" in img_url):
-                            image_urls.append(img_url)
+                            # Check if it's likely the main tweet image
+                            if "twimg" in img_url and ("media" in img_url or "pbs" in img_url):
+                                image_urls.append(img_url)
                 
-                if not image_urls:
-                    # If no good URLs found with filters, just take any non-data URLs as fallback
-                    for img_url in processed_urls:
-                        if not img_url.startswith("data:"):
-                            image_urls.append(img_url)
+                    if not image_urls:
+                        # If no good URLs found with filters, just take any non-data URLs as fallback
+                        for img_url in processed_urls:
+                            if not img_url.startswith("data:"):
+                                image_urls.append(img_url)
                 
-                # Download images
-                if image_urls:
-                    logging.info(f"Found {len(image_urls)} potential image URLs to download.")
+                    # Download images
+                    if image_urls:
+                        logging.info(f"Found {len(image_urls)} potential image URLs to download.")
                     
-                    for i, img_url in enumerate(image_urls):
-                        try:
-                            # Use requests to download
-                            response = requests.get(img_url, stream=True, timeout=30,
-                                                  headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
-                            response.raise_for_status()
-                            
-                            # Determine extension
-                            content_type = response.headers.get('content-type', '')
-                            if 'jpeg' in content_type or 'jpg' in content_type:
-                                ext = '.jpg'
-                            elif 'png' in content_type:
-                                ext = '.png'
-                            elif 'webp' in content_type:
-                                ext = '.webp'
-                            elif 'gif' in content_type:
-                                ext = '.gif'
-                            else:
-                                ext = '.jpg'  # Default to jpg
-                                
-                            temp_image_path = os.path.join(output_dir, f"temp_media_{tweet_id}_{i+1}{ext}")
-                            
-                            with open(temp_image_path, 'wb') as f:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                                    
+                        def image_path_for(index, response):
+                            ext = guess_image_extension(image_urls[index], response.headers.get('content-type'))
+                            return os.path.join(output_dir, f"temp_media_{tweet_id}_{index+1}{ext}")
+
+                        # Fetch in parallel; unlike download_media, keep whatever succeeds
+                        results = fetch_all(image_urls, image_path_for,
+                                            headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"},
+                                            fail_fast=False, resume_dir=output_dir)
+                        for i, (temp_image_path, img_err) in enumerate(results):
+                            if img_err:
+                                logging.error(f"Error downloading image with Selenium: {img_err}")
+                                # Continue with other images instead of failing
+                                continue
                             if os.path.exists(temp_image_path) and os.path.getsize(temp_image_path) > 0:
                                 logging.info(f"Image {i+1} downloaded successfully via Selenium: {temp_image_path}")
                                 downloaded_paths.append(temp_image_path)
                             else:
                                 logging.warning(f"Image download via Selenium finished but file is empty: {temp_image_path}")
-                                
-                        except Exception as img_err:
-                            logging.error(f"Error downloading image with Selenium: {img_err}")
-                            # Continue with other images instead of failing
-                            continue
-            else:
-                logging.error("No video or image elements found on the page.")
-                return None, None
+                else:
+                    logging.error("No video or image elements found on the page.")
+                    return None, None
                 
     except Exception as e:
         logging.exception(f"Error during Selenium-based extraction: {e}")
         return None, None
-        
-    finally:
-        if driver:
-            driver.quit()
     
     if not downloaded_paths:
         logging.error("Selenium extraction completed but no media files were downloaded.")
@@ -688,91 +1224,297 @@ def extract_media_with_selenium(url, output_dir):
     return media_type, downloaded_paths
 
 # Modified to handle different media types
-def process_tweet_url(url):
-    """Downloads media from Twitter URL and converts it to GIF."""
+def process_tweet_url(url, fps=15, width=640, target_bytes=TARGET_SIZE_BYTES, stream=STREAM_ENCODE,
+                      output_format='gif'):
+    """
+    Downloads media from Twitter URL and converts it to GIF, or to another
+    OUTPUT_FORMATS entry ('webp', 'mp4' loop or 'apng') via output_format.
+    Results are cached on (tweet ID, fps, width, format, encoder settings),
+    so repeat requests return the existing file without re-downloading.
+    If target_bytes is set, fps/width/palette/lossy are lowered as needed to
+    keep the GIF under it; pass None to encode exactly at fps/width. The
+    other formats are far smaller to begin with and are encoded as-is.
+    With stream=True, single-file videos are piped into ffmpeg as they download
+    (single-pass GIFs only, and only when predicted to fit target_bytes).
+    """
     if not re.match(r'https?://(www\.)?(twitter\.com|x\.com)/.+/status/\d+', url):
         logging.error("Invalid Twitter URL format.")
         return None
+    if output_format not in OUTPUT_FORMATS:
+        logging.error(f"Unsupported output format: {output_format}")
+        return None
 
-    output_dir = os.path.dirname(os.path.abspath(__file__))
+    output_dir = ARTIFACT_DIR
     tweet_id = get_tweet_id(url)
     if not tweet_id:
-        logging.error("Could not extract tweet ID for naming GIF.")
+        logging.error("Could not extract tweet ID for naming the output.")
         return None
 
-    gif_filename = f"tweet_{tweet_id}.gif"
-    gif_path = os.path.join(output_dir, gif_filename)
-    final_gif_path = None
+    # Check the result cache before touching yt-dlp or ffmpeg
+    result_cache = get_result_cache(output_dir)
+    if output_format == 'gif':
+        # Every tier honours GIF_TWO_PASS (streaming is off under it), so the key names the encode used
+        cache_key = make_cache_key(tweet_id, fps, width, 'gif', GIF_DITHER, GIF_TWO_PASS, target_bytes)
+    else:
+        cache_key = make_cache_key(tweet_id, fps, width, output_format, FORMAT_ENCODERS[output_format])
+    cached_path = result_cache.get(cache_key)
+    if cached_path:
+        logging.info(f"Returning cached {output_format} for tweet {tweet_id}: {cached_path}")
+        return cached_path
+
+    # Content-addressed name so different settings never overwrite each other
+    output_filename = f"tweet_{tweet_id}_{cache_key[:12]}{OUTPUT_FORMATS[output_format]}"
+    output_path = os.path.join(output_dir, output_filename)
+
+    # Identical concurrent requests share one pipeline run
+    return tweet_flights.do(cache_key, build_tweet_output, url, output_path, cache_key,
+                            fps=fps, width=width, target_bytes=target_bytes, stream=stream,
+                            output_format=output_format)
+
+
+def build_tweet_output(url, output_path, cache_key, fps=15, width=640, target_bytes=TARGET_SIZE_BYTES, stream=STREAM_ENCODE,
+                    output_format='gif'):
+    """
+    Produces output_path for process_tweet_url. Works in a partial file and
+    publishes it with an atomic rename, under a cross-process lock so only
+    one worker builds a given artifact.
+    """
+    output_dir = os.path.dirname(output_path)
+    result_cache = get_result_cache(output_dir)
+    with file_lock(output_dir, cache_key):
+        if os.path.exists(output_path):
+            # Another worker process published it while we waited for the lock
+            logging.info(f"{output_format} was published by another worker: {output_path}")
+            result_cache.put(cache_key, output_path)
+            return output_path
+
+        work_path = partial_path(output_path)
+        try:
+            result = run_tweet_pipeline(url, work_path, fps=fps, width=width,
+                                        target_bytes=target_bytes, stream=stream, output_format=output_format)
+            if not result:
+                return None
+            publish(result, output_path)
+            OUTPUT_BYTES.observe(os.path.getsize(output_path), pipeline='twitter', format=output_format)
+            result_cache.put(cache_key, output_path)
+            logging.info(f"Published {output_format}: {output_path}")
+            return output_path
+        finally:
+            if os.path.exists(work_path):
+                try: os.remove(work_path)
+                except OSError: pass
+
+
+def classify_tweet(url, extracted=None):
+    """
+    Content class for tier routing: '<kind>@<host>', where kind is video,
+    image, extract_error or unknown. Before extraction the kind comes from
+    cached metadata or a /photo/ or /video/ link; extracted, a result of
+    extract_tweet_info, settles it (including a failed extraction, whose
+    tiers fail differently from an unseen tweet's).
+    """
+    host = urlparse(url).netloc.lower().removeprefix('www.')
+    if extracted is not None:
+        info, status = extracted
+        if status != 'ok':
+            return f"{'image' if status == 'no_video' else 'extract_error'}@{host}"
+    else:
+        info = metadata_cache.get(f"twitter:{get_tweet_id(url)}", required_fields=())
+    if not info:
+        path = urlparse(url).path
+        kind = 'image' if '/photo/' in path else 'video' if '/video/' in path else 'unknown'
+        return f"{kind}@{host}"
+    formats = info.get('formats') or [f for e in info.get('entries') or [] if e for f in e.get('formats') or []]
+    if formats:
+        is_video = any(f.get('vcodec', 'none') != 'none' for f in formats)
+    else:
+        is_video = bool(info.get('duration')) or info.get('vcodec', 'none') != 'none'
+    return f"{'video' if is_video else 'image'}@{host}"
+
+
+def acquire_tweet_media(url, gif_path, download_dir, fps=15, width=640, stream=STREAM_ENCODE, target_bytes=None):
+    """
+    Tries the media tiers in the order tweet_router suggests for this kind
+    of tweet: 'stream' (encode while downloading), 'download' (download_media)
+    and 'selenium'. Returns (gif_path or None, media_type, media_paths);
+    gif_path is set when the stream tier already produced the GIF. With
+    target_bytes, videos predicted to stream over it skip the stream tier.
+    The yt-dlp info is extracted once, by the first tier that needs it,
+    and shared with the others (including a failed extraction). When that
+    extraction changes the tweet's class, the remaining tiers are planned
+    again under the new class.
+    """
+    content_class = classify_tweet(url)
+    remaining = ['stream', 'download', 'selenium'] if stream else ['download', 'selenium']
+    if stream and content_class.startswith('image@'):
+        remaining.remove('stream') # Only single-file videos can be streamed
+    extracted = None # (media_info, status) from extract_tweet_info
+    planned = tweet_router.plan(content_class, remaining)
+    while planned:
+        tier = planned.pop(0)
+        remaining.remove(tier)
+        started = time.monotonic()
+        final_gif_path, media_type, media_paths, error = None, None, None, None
+        applicable = True
+        try:
+            if tier in ('stream', 'download') and extracted is None:
+                extracted = extract_tweet_info(url)
+            if tier == 'stream':
+                media_info, status = extracted
+                if status == 'ok' and stream_overshoots(media_info, fps=fps, width=width, target_bytes=target_bytes):
+                    applicable = False # Not a stream failure: the size search needs the download path
+                elif status == 'ok':
+                    with stage_timer('twitter', 'stream_encode'):
+                        final_gif_path = stream_tweet_video_to_gif(media_info, gif_path, fps=fps, width=width)
+                media_type = 'video' if final_gif_path else None
+            elif tier == 'download':
+                logging.info(f"Attempting to download media to {download_dir}")
+                media_type, media_paths = download_media(url, download_dir, extracted=extracted)
+            else:
+                logging.warning("Trying browser-based extraction...")
+                with stage_timer('twitter', 'selenium'):
+                    media_type, media_paths = extract_media_with_selenium(url, download_dir)
+        except Exception as e:
+            logging.exception(f"Media tier '{tier}' raised: {e}")
+            error = type(e).__name__
+        succeeded = bool(final_gif_path or (media_type and media_paths))
+        revealed = classify_tweet(url, extracted) if extracted is not None else content_class
+        # An image tweet has nothing to stream, so that attempt is not a stream failure
+        if tier == 'stream' and revealed.startswith('image@'):
+            applicable = False
+        if applicable:
+            record_tier('twitter', tier, succeeded)
+            # Recorded under the class it was planned for, so the stats describe the requests that class routes
+            tweet_router.record(content_class, tier, succeeded, time.monotonic() - started, error)
+        if succeeded:
+            return final_gif_path, media_type, media_paths or []
+        if revealed != content_class:
+            logging.info(f"Extraction shows {url} is {revealed}, not {content_class}; re-planning {remaining}")
+            content_class = revealed
+            if content_class.startswith('image@') and 'stream' in remaining:
+                remaining.remove('stream')
+            planned = tweet_router.plan(content_class, remaining)
+    logging.error("Failed to download media or determine type with every extraction tier.")
+    return None, None, []
+
+
+def encode_with_tier(tier, func, *args, **kwargs):
+    """Runs a conversion on the pool, recording its duration and outcome under `tier`."""
+    with stage_timer('twitter', f"encode_{tier}"):
+        result = run_conversion(func, *args, **kwargs)
+    output = result[0] if isinstance(result, tuple) else result
+    record_tier('twitter', tier, bool(output))
+    return result
+
+
+def run_tweet_pipeline(url, output_path, fps=15, width=640, target_bytes=TARGET_SIZE_BYTES, stream=STREAM_ENCODE,
+                       output_format='gif'):
+    """Downloads the tweet's media and converts it to output_path in output_format. Returns output_path or None."""
+    final_path = None
+    size_targeted = False # Set once the size search has already run on this GIF
     temp_media_paths = [] # Keep track of temp files
 
     try:
-        with tempfile.TemporaryDirectory() as temp_download_dir:
-            logging.info(f"Attempting to download media to {temp_download_dir}")
-            media_type, temp_media_paths = download_media(url, temp_download_dir)
-
-            if not media_type or not temp_media_paths:
-                # New: Try selenium fallback if download_media fails
-                logging.warning("Standard extraction methods failed. Trying browser-based extraction...")
-                media_type, temp_media_paths = extract_media_with_selenium(url, temp_download_dir)
-                
-                if not media_type or not temp_media_paths:
-                    logging.error("Failed to download media or determine type even with browser-based extraction.")
-                    return None
+        # Downloads persist per tweet, so a retry after a failure or restart resumes instead of starting over
+        with partial_area('twitter', get_tweet_id(url)) as temp_download_dir:
+            final_path, media_type, temp_media_paths = acquire_tweet_media(
+                url, output_path, temp_download_dir, fps=fps, width=width, target_bytes=target_bytes,
+                # The stream tier only encodes single-pass GIFs: a pipe can't be read twice for a palette file
+                stream=stream and output_format == 'gif' and not GIF_TWO_PASS)
+            if not final_path and not temp_media_paths:
+                return None
+
+            if temp_media_paths:
+                DOWNLOAD_BYTES.observe(sum(os.path.getsize(p) for p in temp_media_paths if os.path.exists(p)),
+                                       pipeline='twitter')
 
             # --- Convert based on type ---
-            if media_type == 'video':
+            if final_path:
+                pass # Already encoded from the stream; size target is applied below
+            elif output_format != 'gif' and media_type in ('video', 'image'):
+                if media_type == 'video' and len(temp_media_paths) != 1:
+                    logging.error("Expected one video path, but got multiple or none.")
+                    return None
+                # No GIF-only fallbacks here: MoviePy and PIL can't write these formats
+                logging.info(f"Converting {media_type} to {output_format} using ffmpeg: {output_path}")
+                final_path = encode_with_tier('ffmpeg', convert_to_format_ffmpeg, temp_media_paths, output_path,
+                                              output_format, fps=fps, width=width, images=media_type == 'image')
+            elif media_type == 'video':
                 if len(temp_media_paths) == 1:
                     # Try ffmpeg-based conversion first
-                    logging.info(f"Converting video to GIF using ffmpeg: {gif_path}")
-                    final_gif_path = convert_to_gif_ffmpeg(temp_media_paths[0], gif_path, fps=15, width=640)
+                    logging.info(f"Converting video to GIF using ffmpeg: {output_path}")
+                    if target_bytes:
+                        final_path, chosen = encode_with_tier('ffmpeg', convert_to_gif_target_size, temp_media_paths[0], output_path,
+                                                              fps=fps, width=width, target_bytes=target_bytes)
+                        size_targeted = bool(final_path)
+                        if chosen and not chosen['target_met']:
+                            logging.warning(f"Publishing a GIF over the size target ({chosen['size']} bytes > {int(target_bytes)})")
+                    else:
+                        final_path = encode_with_tier('ffmpeg', convert_to_gif_ffmpeg, temp_media_paths[0], output_path, fps=fps, width=width)
                     
                     # If ffmpeg fails, fall back to MoviePy
-                    if not final_gif_path:
+                    if not final_path:
                         logging.warning("FFmpeg conversion failed, falling back to MoviePy...")
-                        final_gif_path = convert_to_gif(temp_media_paths[0], gif_path)
+                        final_path = encode_with_tier('moviepy', convert_to_gif, temp_media_paths[0], output_path)
                 else:
                     logging.error("Expected one video path, but got multiple or none.")
                     return None
             elif media_type == 'image':
-                 logging.info(f"Converting {len(temp_media_paths)} image(s) to GIF: {gif_path}")
+                 logging.info(f"Converting {len(temp_media_paths)} image(s) to GIF: {output_path}")
                  # Try FFmpeg method first for images
-                 final_gif_path = convert_images_to_gif_ffmpeg(temp_media_paths, gif_path)
+                 final_path = encode_with_tier('ffmpeg', convert_images_to_gif_ffmpeg, temp_media_paths, output_path)
                 
                  # Fall back to PIL if FFmpeg fails
-                 if not final_gif_path:
+                 if not final_path:
                      logging.warning("FFmpeg image-to-GIF conversion failed, falling back to PIL...")
-                     final_gif_path = convert_images_to_gif(temp_media_paths, gif_path)
+                     final_path = encode_with_tier('pil', convert_images_to_gif, temp_media_paths, output_path, width=width)
             else:
                  logging.error(f"Unsupported media type detected: {media_type}")
                  return None
 
-            # Check if GIF was created successfully (no compression anymore)
-            if final_gif_path and os.path.exists(final_gif_path):
-                logging.info(f"Processing complete. Final GIF at: {final_gif_path}")
-                return final_gif_path
+            # Image GIFs and the MoviePy fallback skip the size search; bring them under the target here
+            if (target_bytes and output_format == 'gif' and not size_targeted
+                    and final_path and os.path.exists(final_path)):
+                with stage_timer('twitter', 'compress'):
+                    if not run_conversion(compress_gif, final_path, target_bytes=target_bytes):
+                        logging.warning(f"Publishing a GIF over the size target: {final_path}")
+
+            # Check if the output was created successfully
+            if final_path and os.path.exists(final_path):
+                logging.info(f"Processing complete. Final {output_format} at: {final_path}")
+                discard_area(temp_download_dir)
+                return final_path
             else:
-                logging.error(f"Failed to create GIF from {media_type}.")
+                logging.error(f"Failed to create {output_format} from {media_type}.")
                 return None
 
     except Exception as e:
         logging.exception(f"An unexpected error occurred during processing: {e}")
         return None
-    # No finally block needed as TemporaryDirectory handles cleanup of temp_media_paths
+    # Downloads are kept on failure for the next attempt; abandoned areas expire after PARTIAL_TTL_SECONDS
 
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Download a video from a Twitter URL and convert it to a GIF.')
     parser.add_argument('url', type=str, help='The Twitter video URL')
+    parser.add_argument('--fps', type=int, default=15, help='Frames per second for video GIFs')
+    parser.add_argument('--width', type=int, default=640, help='Output width in pixels for video GIFs')
+    parser.add_argument('--target-mb', type=float, default=TARGET_SIZE_MB,
+                        help='Keep the GIF under this size in MB (0 disables size targeting)')
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='gif',
+                        help='Output format: gif, animated webp, looping mp4 or apng')
 
     # Parse arguments
     args = parser.parse_args()
 
     # Call the processing function with the URL argument
-    result_path = process_tweet_url(args.url)
+    result_path = process_tweet_url(args.url, fps=args.fps, width=args.width,
+                                    target_bytes=args.target_mb * 1024 * 1024 or None,
+                                    output_format=args.format)
 
     if result_path:
-        print(f"Success! GIF created at: {result_path}") # Print success path for potential capture
+        print(f"Success! {args.format.upper()} created at: {result_path}") # Print success path for potential capture
         sys.exit(0) # Exit with success code
     else:
         print("Processing failed. Check logs for details.") # Print failure message
@@ -781,103 +1523,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-def convert_images_to_gif_ffmpeg(image_paths, gif_path, fps=10):
-    """
-    Converts a sequence of images to an animated GIF using ffmpeg with palette optimization.
-    This offers better quality than the PIL-based method.
-    """
-    if not image_paths:
-        logging.error("No image paths provided for FFmpeg GIF conversion.")
-        return None
-
-    # First, ensure the image paths are sorted correctly
-    image_paths = sorted(image_paths)
-    
-    # Create temporary directory for FFmpeg sequence
-    with tempfile.TemporaryDirectory() as temp_seq_dir:
-        # Create symbolic links or copies with sequential names for ffmpeg
-        seq_paths = []
-        for i, img_path in enumerate(image_paths):
-            # Get original extension
-            ext = os.path.splitext(img_path)[1]
-            seq_name = f"seq_{i:04d}{ext}"
-            seq_path = os.path.join(temp_seq_dir, seq_name)
-            
-            # Create copy of the image with sequential name
-            try:
-                shutil.copy2(img_path, seq_path)
-                seq_paths.append(seq_path)
-            except Exception as e:
-                logging.error(f"Error copying image to sequence: {e}")
-                return None
-
-        if not seq_paths:
-            logging.error("Failed to create image sequence for FFmpeg.")
-            return None
-            
-        # Generate palette from the sequence
-        palette_path = os.path.join(temp_seq_dir, "palette.png")
-        pattern = os.path.join(temp_seq_dir, f"seq_%04d{ext}")
-        
-        # Determine frame rate based on number of images
-        # Use slow frame rate for few images, faster for many
-        if len(image_paths) <= 2:
-            adjusted_fps = 1  # Very slow for 1-2 images
-        elif len(image_paths) <= 5:
-            adjusted_fps = 2  # Slow for 3-5 images
-        else:
-            adjusted_fps = fps  # Default for 6+ images
-            
-        # Step 1: Create palette
-        palette_cmd = [
-            'ffmpeg',
-            '-f', 'image2',
-            '-i', pattern,
-            '-vf', f"fps={adjusted_fps},palettegen=stats_mode=single",
-            '-y', palette_path
-        ]
-            
-        logging.info(f"Generating palette for image sequence: {' '.join(palette_cmd)}")
-        
-        try:
-            subprocess.run(palette_cmd, check=True, capture_output=True)
-            
-            if not os.path.exists(palette_path):
-                logging.error("Failed to generate palette for image sequence.")
-                return None
-                
-            # Step 2: Convert using palette
-            convert_cmd = [
-                'ffmpeg',
-                '-f', 'image2',
-                '-i', pattern,
-                '-i', palette_path,
-                '-filter_complex', f"fps={adjusted_fps}[x];[x][1:v]paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle",
-                '-y', gif_path
-            ]
-            
-            logging.info(f"Creating GIF from image sequence: {' '.join(convert_cmd)}")
-            
-            subprocess.run(convert_cmd, check=True, capture_output=True)
-            
-            if os.path.exists(gif_path):
-                logging.info(f"FFmpeg image-to-GIF created successfully: {gif_path}")
-                return gif_path
-            else:
-                logging.error("FFmpeg image-to-GIF conversion failed: output file not found.")
-                return None
-                
-        except subprocess.CalledProcessError as e:
-            logging.error(f"FFmpeg error during image-to-GIF conversion: {e}")
-            if e.stderr:
-                logging.error(f"FFmpeg stderr: {e.stderr.decode()}")
-            if os.path.exists(gif_path):
-                try:
-                    os.remove(gif_path)
-                except OSError:
-                    pass
-            return None
-        except FileNotFoundError:
-            logging.error("FFmpeg command not found. Ensure FFmpeg is installed and in your PATH.")
-            return None
@@ -4,11 +4,18 @@ import logging
 import yt_dlp
 from yt_dlp.utils import DownloadError
 import glob  # Make sure this is imported
+from metadata_cache import metadata_cache, cached_extract_info
+from result_cache import ARTIFACT_DIR, get_result_cache, make_cache_key
+from single_flight import SingleFlight, file_lock, publish
+from metrics import stage_timer, record_tier, DOWNLOAD_BYTES, OUTPUT_BYTES
+from progress import ytdlp_progress_hook
+from partial_downloads import partial_area, discard_area, check_manifest, formats_fingerprint
 
 # Configure logging
-print("Youtube Downloader") 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+youtube_flights = SingleFlight() # Coalesces concurrent downloads of the same video
+
 def get_video_id(url):
     """Extracts the video ID from a YouTube URL."""
     # Handle different YouTube URL formats
@@ -24,7 +31,7 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
     
     Args:
         url (str): YouTube URL
-        output_dir (str, optional): Directory to save the file. Defaults to script directory.
+        output_dir (str, optional): Directory to save the file. Defaults to the artifact store.
         quality (str, optional): Quality setting. Options: 'best', 'medium', 'worst'. Defaults to 'best'.
         format (str, optional): Output format. Defaults to 'mp4'.
         
@@ -32,7 +39,7 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
         str: Path to the downloaded file, or None if download failed.
     """
     if output_dir is None:
-        output_dir = os.path.dirname(os.path.abspath(__file__))
+        output_dir = ARTIFACT_DIR
     
     logging.info(f"YouTube download function called with URL: {url}")
     logging.info(f"Output directory: {output_dir}")
@@ -43,7 +50,47 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
         return None
     
     logging.info(f"Extracted video ID: {video_id}")
-    
+
+    cached_path = get_result_cache(output_dir).get(make_cache_key('youtube', video_id, quality, format))
+    if cached_path:
+        logging.info(f"Returning cached download for video {video_id}: {cached_path}")
+        return cached_path
+
+    # Identical concurrent requests share one download
+    flight_key = f"youtube:{video_id}:{quality}:{format}"
+    return youtube_flights.do(flight_key, _download_youtube_video_locked,
+                              url, output_dir, video_id, quality, format, flight_key)
+
+def _download_youtube_video_locked(url, output_dir, video_id, quality, format, flight_key):
+    """
+    Holds the cross-process lock for this video while it downloads into its
+    persistent partial area, then publishes the finished file to output_dir.
+    """
+    result_cache = get_result_cache(output_dir)
+    cache_key = make_cache_key('youtube', video_id, quality, format)
+    with file_lock(output_dir, flight_key):
+        cached_path = result_cache.get(cache_key)
+        if cached_path:
+            # Another worker process published it while we waited for the lock
+            logging.info(f"Video was downloaded by another worker: {cached_path}")
+            return cached_path
+        with partial_area('youtube', video_id, quality, format) as download_dir:
+            downloaded_file = fetch_youtube_video(url, download_dir, video_id, quality, format)
+            if downloaded_file:
+                downloaded_file = publish(downloaded_file, os.path.join(output_dir, os.path.basename(downloaded_file)))
+                discard_area(download_dir)
+        # Indexing the file puts it under the store's TTL and size budget; done under
+        # the lock so a worker waiting on it finds the entry
+        result_cache.put(cache_key, downloaded_file)
+    return downloaded_file
+
+def fetch_youtube_video(url, output_dir, video_id, quality='best', format='mp4'):
+    """
+    Does the actual yt-dlp download for download_youtube_video.
+    yt-dlp writes into .part/.temp files and renames on completion, so the
+    final file only appears once it is complete. .part files left in
+    output_dir by an interrupted attempt are continued.
+    """
     # Determine format based on quality
     if quality == 'best':
         format_str = f'bestvideo[ext={format}]+bestaudio[ext=m4a]/best[ext={format}]/best'
@@ -54,8 +101,9 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
     else:
         format_str = f'bestvideo[ext={format}]+bestaudio[ext=m4a]/best[ext={format}]/best'
     
-    # Set up output filename template
-    output_template = os.path.join(output_dir, f'youtube_{video_id}.%(ext)s')
+    # Set up output filename template; non-default qualities get their own file
+    file_base = f'youtube_{video_id}' if quality == 'best' else f'youtube_{video_id}_{quality}'
+    output_template = os.path.join(output_dir, f'{file_base}.%(ext)s')
     logging.info(f"Using output template: {output_template}")
     
     # Let's use simpler options to diagnose issues
@@ -66,6 +114,8 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
         'quiet': False,  # Set to False to see all output
         'verbose': True,  # Add verbose output for debugging
         'no_warnings': False,  # Show warnings
+        'continuedl': True,  # Resume .part files from an interrupted attempt
+        'progress_hooks': [ytdlp_progress_hook()],  # Feeds the job's /events stream
     }
     
     logging.info(f"YoutubeDL options: {ydl_opts}")
@@ -74,16 +124,20 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             # First, extract info without downloading to make sure we can access the video
-            info = ydl.extract_info(url, download=False)
+            with stage_timer('youtube', 'extract'):
+                info = cached_extract_info(ydl, url, f"youtube:{video_id}")
             if not info:
                 logging.error("Failed to extract video information.")
                 return None
             
             logging.info(f"Video info extracted successfully. Title: {info.get('title')}")
+            # Only resume partial data that belongs to these exact streams
+            check_manifest(output_dir, formats_fingerprint(info))
             logging.info(f"Beginning actual download process...")
             
-            # Now download the video
-            download_info = ydl.extract_info(url, download=True)
+            # Now download the video, reusing the extracted info instead of fetching it again
+            with stage_timer('youtube', 'download'):
+                download_info = ydl.process_ie_result(info, download=True)
             
             # Try to determine the output file path
             downloaded_file = None
@@ -103,9 +157,10 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
             
             # Method 3: Search for files matching pattern
             if not downloaded_file or not os.path.exists(downloaded_file):
-                search_pattern = os.path.join(output_dir, f'youtube_{video_id}.*')
+                search_pattern = os.path.join(output_dir, f'{file_base}.*')
                 logging.info(f"Method 3 - Searching for files with pattern: {search_pattern}")
-                matches = glob.glob(search_pattern)
+                # Skip yt-dlp's in-progress files
+                matches = [f for f in glob.glob(search_pattern) if not f.endswith(('.part', '.ytdl'))]
                 if matches:
                     # Sort by modification time, newest first
                     matches.sort(key=os.path.getmtime, reverse=True)
@@ -117,19 +172,27 @@ def download_youtube_video(url, output_dir=None, quality='best', format='mp4'):
             if downloaded_file and os.path.exists(downloaded_file):
                 logging.info(f"YouTube video downloaded successfully to: {downloaded_file}")
                 logging.info(f"File size: {os.path.getsize(downloaded_file)} bytes")
+                record_tier('youtube', 'ytdlp', True)
+                DOWNLOAD_BYTES.observe(os.path.getsize(downloaded_file), pipeline='youtube')
+                OUTPUT_BYTES.observe(os.path.getsize(downloaded_file), pipeline='youtube',
+                                     format=os.path.splitext(downloaded_file)[1].lstrip('.'))
                 return downloaded_file
             else:
                 logging.error(f"Download seemed to succeed but file not found at expected path.")
-                # List all files in the output directory as a last-ditch effort
-                all_files = os.listdir(output_dir)
-                logging.info(f"All files in {output_dir}: {all_files}")
+                # List this video's files as a last-ditch effort
+                video_files = glob.glob(os.path.join(output_dir, f'*{video_id}*'))
+                logging.info(f"Files for {video_id} in {output_dir}: {video_files}")
+                record_tier('youtube', 'ytdlp', False)
                 return None
     
     except DownloadError as e:
         logging.error(f"YouTube download error: {e}")
+        metadata_cache.invalidate(f"youtube:{video_id}") # Cached media URLs may be dead
+        record_tier('youtube', 'ytdlp', False)
         return None
     except Exception as e:
         logging.exception(f"Unexpected error during YouTube download: {e}")
+        record_tier('youtube', 'ytdlp', False)
         return None
 
 if __name__ == "__main__":
@@ -1,12 +1,25 @@
+import time
+_BOOT_STARTED = time.perf_counter() # Measured before the heavy imports below
+
 import os
+import re
+import json
 from datetime import datetime  # Add missing import
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import logging
+import threading
+import multiprocessing
 
 # Import the functions from your existing scripts
-from TwitterLinktoGIF import process_tweet_url
-from YouTube_Downloader import download_youtube_video  # Import the new function
+from TwitterLinktoGIF import process_tweet_url, tweet_flights, tweet_router, get_tweet_id, OUTPUT_FORMATS, OUTPUT_MIMETYPES
+from YouTube_Downloader import download_youtube_video, youtube_flights, get_video_id  # Import the new function
+from conversion_pool import conversion_pool
+from metrics import REGISTRY, Gauge
+from job_queue import JobQueue, JOB_FINISHED, JOB_FAILED
+from file_serving import serve_artifact, resolve_artifacts, stream_zip
+from result_cache import ARTIFACT_DIR, get_result_cache, start_janitor
+from browser_pool import browser_pool, SELENIUM_AVAILABLE, BROWSER_POOL_WARM
 
 # Configure logging for the Flask app
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,11 +28,100 @@ app = Flask(__name__)
 CORS(app)
 
 # Define the directory where files are saved
-OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = ARTIFACT_DIR
+BOOT_TIME_TARGET_SECONDS = float(os.environ.get('BOOT_TIME_TARGET_SECONDS', 2.0)) # Import-to-ready budget for a new worker
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_STREAM_TIMEOUT_SECONDS = int(os.environ.get('BATCH_STREAM_TIMEOUT_SECONDS', 60)) # Longest a results stream stays open
+BATCH_POLL_INTERVAL = 0.5
+ZIP_MAX_FILES = int(os.environ.get('ZIP_MAX_FILES', 100))
+EVENTS_POLL_INTERVAL = 0.25 # How often an SSE stream checks its job for changes
+EVENTS_KEEPALIVE_SECONDS = 15 # Comment line sent on quiet streams so proxies keep them open
+# Each open stream holds a request thread, so streams are short-lived (clients reconnect) and capped per process
+EVENTS_STREAM_SECONDS = int(os.environ.get('EVENTS_STREAM_SECONDS', 30))
+EVENTS_RETRY_MS = 2000 # Reconnect delay sent to EventSource clients
+STREAM_MAX_CONCURRENT = int(os.environ.get('STREAM_MAX_CONCURRENT', max(1, int(os.environ.get('WEB_THREADS', 8)) // 2)))
+TWITTER_URL_RE = r'https?://(www\.)?(twitter\.com|x\.com)/.+/status/\d+'
+
+# Bounded worker pool so slow downloads/encodes don't tie up HTTP threads
+job_queue = JobQueue()
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONCURRENT)
+
+# Launch headless browsers in the background so the Selenium tier starts warm
+# (skipped in conversion pool workers, which re-import this module)
+if SELENIUM_AVAILABLE and BROWSER_POOL_WARM > 0 and multiprocessing.parent_process() is None:
+    threading.Thread(target=browser_pool.warm, name='browser-warmup', daemon=True).start()
+
+# Expire old artifacts and keep the store under its size budget
+if multiprocessing.parent_process() is None:
+    start_janitor(OUTPUT_DIR)
+
+# Scrape-time gauges for queue depth and work in flight
+REGISTRY.register(Gauge(
+    'jobs', 'Jobs known to the queue by status.', ('status',),
+    callback=lambda: {(status,): count for status, count in job_queue.counts().items()}))
+REGISTRY.register(Gauge(
+    'conversions', 'Conversions waiting for or holding a conversion slot.', ('state',),
+    callback=lambda: dict(zip([('waiting',), ('running',)], conversion_pool.stats()))))
+REGISTRY.register(Gauge(
+    'tier_success_ratio', 'Recent success rate of each media tier by content class.', ('pipeline', 'class', 'tier'),
+    callback=lambda: {('twitter', content_class, tier): stats['successRate']
+                      for content_class, tiers in tweet_router.snapshot().items() for tier, stats in tiers.items()}))
+REGISTRY.register(Gauge(
+    'inflight_requests', 'Distinct media items currently being processed.', ('pipeline',),
+    callback=lambda: {('twitter',): tweet_flights.in_flight(), ('youtube',): youtube_flights.in_flight()}))
+
+def _report_boot_time():
+    """Logs how long this process took to become ready, against BOOT_TIME_TARGET_SECONDS."""
+    boot_seconds = time.perf_counter() - _BOOT_STARTED
+    REGISTRY.register(Gauge('process_boot_seconds', 'Seconds from first import to app ready.', callback=lambda: boot_seconds))
+    if boot_seconds > BOOT_TIME_TARGET_SECONDS:
+        logging.warning(f"App ready in {boot_seconds:.2f}s, over the {BOOT_TIME_TARGET_SECONDS:.2f}s boot target. "
+                        f"Run 'python benchmark.py --startup' for a per-module import report.")
+    else:
+        logging.info(f"App ready in {boot_seconds:.2f}s (target {BOOT_TIME_TARGET_SECONDS:.2f}s)")
+
+def _result_for(result_path):
+    """Builds the job result payload the frontend uses to fetch a file."""
+    filename = os.path.basename(result_path)
+    return {'path': result_path, 'downloadUrl': f"/downloads/{filename}", 'filename': filename}
+
+def run_twitter_job(url, fps=15, width=640, output_format='gif'):
+    """Worker body for /process-twitter jobs."""
+    result_path = process_tweet_url(url, fps=fps, width=width, output_format=output_format)
+    if not result_path:
+        logging.error(f"Failed to process URL: {url}")
+        return None
+    logging.info(f"Successfully processed URL. {output_format.upper()} at: {result_path}")
+    return _result_for(result_path)
+
+def run_youtube_job(url, quality, format):
+    """Worker body for /process-youtube jobs."""
+    result_path = download_youtube_video(url, output_dir=OUTPUT_DIR, quality=quality, format=format)
+    if not result_path:
+        logging.error(f"Failed to process YouTube URL: {url}")
+        return None
+    logging.info(f"Download successful. File at: {result_path}")
+    logging.info(f"File exists: {os.path.exists(result_path)}, Size: {os.path.getsize(result_path)} bytes")
+    return _result_for(result_path)
+
+def _negotiate_twitter_format(requested):
+    """
+    Picks the output format for a Twitter request: an explicit 'format'
+    in the body wins, otherwise ('auto' or absent) the best match for the
+    Accept header, defaulting to GIF. Returns None for an unknown format.
+    """
+    if requested and requested != 'auto':
+        return requested if requested in OUTPUT_FORMATS else None
+    best = request.accept_mimetypes.best_match(list(OUTPUT_MIMETYPES), default='image/gif')
+    return OUTPUT_MIMETYPES[best]
 
 @app.route('/process-twitter', methods=['POST'])
 def handle_twitter_request():
-    """Handles POST requests to process a Twitter URL."""
+    """
+    Handles POST requests to process a Twitter URL. The output is a GIF
+    unless the body's 'format' (gif/webp/mp4/apng) or the Accept header
+    asks for another format.
+    """
     # ADD THIS LINE:
     logging.info(f"--- Twitter POST request received ---")
     data = request.get_json()
@@ -28,25 +130,15 @@ def handle_twitter_request():
         return jsonify({'status': 'Error', 'message': 'Missing URL in request'}), 400
 
     url = data['url']
-    logging.info(f"Received request to process Twitter URL: {url}")
+    output_format = _negotiate_twitter_format(data.get('format'))
+    if not output_format:
+        return jsonify({'status': 'Error',
+                        'message': f"'format' must be one of: auto, {', '.join(OUTPUT_FORMATS)}"}), 400
+    logging.info(f"Received request to process Twitter URL: {url} as {output_format}")
 
-    try:
-        # Call the processing function
-        result_path = process_tweet_url(url)
-
-        if result_path:
-            logging.info(f"Successfully processed URL. GIF at: {result_path}")
-            # Return only the filename for security/simplicity, construct download URL later
-            filename = os.path.basename(result_path)
-            # Create a URL the frontend can use to fetch the GIF
-            download_url = f"/downloads/{filename}"
-            return jsonify({'status': 'Success', 'path': result_path, 'downloadUrl': download_url})
-        else:
-            logging.error(f"Failed to process URL: {url}")
-            return jsonify({'status': 'Error', 'message': 'Failed to download or convert video. Check backend logs.'}), 500
-    except Exception as e:
-        logging.exception(f"An unexpected error occurred while processing {url}: {e}")
-        return jsonify({'status': 'Error', 'message': f'An internal server error occurred: {e}'}), 500
+    job = job_queue.submit('twitter', {'url': url, 'format': output_format}, run_twitter_job, url,
+                           output_format=output_format)
+    return jsonify({'status': 'Queued', 'jobId': job.id, 'statusUrl': f"/jobs/{job.id}"}), 202
 
 @app.route('/process-youtube', methods=['POST'])
 def handle_youtube_request():
@@ -73,37 +165,246 @@ def handle_youtube_request():
         logging.info(f"Output directory: {OUTPUT_DIR}")
         logging.info(f"Directory exists: {os.path.exists(OUTPUT_DIR)}, Writable: {os.access(OUTPUT_DIR, os.W_OK)}")
 
-        # Call the YouTube download function
-        result_path = download_youtube_video(url, output_dir=OUTPUT_DIR, quality=quality, format=format)
-        
-        if result_path:
-            logging.info(f"Download successful. File at: {result_path}")
-            logging.info(f"File exists: {os.path.exists(result_path)}, Size: {os.path.getsize(result_path)} bytes")
-            
-            filename = os.path.basename(result_path)
-            download_url = f"/downloads/{filename}"
-            
-            response_data = {
-                'status': 'Success', 
-                'path': result_path, 
-                'downloadUrl': download_url,
-                'filename': filename
-            }
-            logging.info(f"Sending response: {response_data}")
-            return jsonify(response_data)
-        else:
-            logging.error(f"Failed to process YouTube URL: {url}")
-            return jsonify({'status': 'Error', 'message': 'Failed to download video. Check backend logs.'}), 500
+        job = job_queue.submit('youtube', {'url': url, 'quality': quality, 'format': format},
+                               run_youtube_job, url, quality, format)
+        return jsonify({'status': 'Queued', 'jobId': job.id, 'statusUrl': f"/jobs/{job.id}"}), 202
     except Exception as e:
-        logging.exception(f"An unexpected error occurred while processing YouTube request: {e}")
+        logging.exception(f"An unexpected error occurred while queueing YouTube request: {e}")
         return jsonify({'status': 'Error', 'message': f'An internal server error occurred: {e}'}), 500
 
+def _plan_batch_item(item):
+    """
+    Validates one /process-batch item. Returns (kind, dedupe_key, params, func, args),
+    or an error message string if the item can't be processed.
+    """
+    if isinstance(item, str):
+        item = {'url': item}
+    if not isinstance(item, dict) or not isinstance(item.get('url'), str):
+        return "Each item needs a 'url'"
+    url = item['url'].strip()
+    if re.match(TWITTER_URL_RE, url):
+        try:
+            fps, width = int(item.get('fps', 15)), int(item.get('width', 640))
+        except (TypeError, ValueError):
+            return "'fps' and 'width' must be integers"
+        if not (1 <= fps <= 50 and 16 <= width <= 1920):
+            return "'fps' must be 1-50 and 'width' 16-1920"
+        output_format = item.get('format', 'gif')
+        if output_format not in OUTPUT_FORMATS:
+            return f"Twitter 'format' must be one of: {', '.join(OUTPUT_FORMATS)}"
+        key = ('twitter', get_tweet_id(url), fps, width, output_format)
+        return ('twitter', key, {'url': url, 'fps': fps, 'width': width, 'format': output_format},
+                run_twitter_job, (url, fps, width, output_format))
+    video_id = get_video_id(url)
+    if video_id:
+        quality, format = item.get('quality', 'best'), item.get('format', 'mp4')
+        key = ('youtube', video_id, quality, format)
+        return ('youtube', key, {'url': url, 'quality': quality, 'format': format},
+                run_youtube_job, (url, quality, format))
+    return 'Not a Twitter/X status or YouTube video URL'
+
+def _batch_item_view(item):
+    """A batch item merged with its job's current status."""
+    view = dict(item)
+    job = job_queue.get(item['jobId']) if 'jobId' in item else None
+    if job:
+        view.update(job.to_dict())
+    elif 'jobId' in item:
+        view.update({'status': JOB_FAILED, 'error': 'Job expired or not found.'})
+    return view
+
+@app.route('/process-batch', methods=['POST'])
+def handle_batch_request():
+    """
+    Queues a list of Twitter and YouTube items in one request. Items are
+    URL strings or objects with 'url' plus per-item options (fps/width/format
+    for Twitter, quality/format for YouTube). Identical items share one job.
+    """
+    logging.info("--- Batch POST request received ---")
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'status': 'Error', 'message': "Request needs a non-empty 'items' list"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'status': 'Error', 'message': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+
+    jobs = {}  # dedupe key -> Job
+    batch_items = []
+    for index, item in enumerate(items):
+        plan = _plan_batch_item(item)
+        if isinstance(plan, str):
+            batch_items.append({'index': index, 'status': JOB_FAILED, 'error': plan})
+            continue
+        kind, key, params, func, args = plan
+        job = jobs.get(key)
+        if job is None:
+            job = jobs[key] = job_queue.submit(kind, params, func, *args)
+        batch_items.append({'index': index, 'kind': kind, 'jobId': job.id, 'statusUrl': f"/jobs/{job.id}"})
+
+    batch = job_queue.create_batch(batch_items)
+    logging.info(f"Batch {batch['batchId']}: {len(items)} items, {len(jobs)} unique jobs")
+    return jsonify({
+        'status': 'Queued',
+        'batchId': batch['batchId'],
+        'statusUrl': f"/batches/{batch['batchId']}",
+        'resultsUrl': f"/batches/{batch['batchId']}/results",
+        'uniqueJobs': len(jobs),
+        'items': batch_items,
+    }), 202
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Reports every item of a batch with its job's current status."""
+    batch = job_queue.get_batch(batch_id)
+    if not batch:
+        return jsonify({'status': 'Error', 'message': 'Batch not found.'}), 404
+    views = [_batch_item_view(item) for item in batch['items']]
+    done = all(view['status'] in (JOB_FINISHED, JOB_FAILED) for view in views)
+    return jsonify({'batchId': batch_id, 'done': done, 'items': views})
+
+def _stream_response(generate, mimetype):
+    """
+    Response for a long-lived stream, holding one of this process's
+    STREAM_MAX_CONCURRENT stream slots until it closes. Returns None when
+    they are all taken, so streams can't occupy every request thread.
+    """
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    response = Response(generate(), mimetype=mimetype)
+    response.call_on_close(_stream_slots.release)
+    return response
+
+def _streams_busy():
+    response = jsonify({'status': 'Error', 'message': 'Too many open streams; poll the status URL instead.'})
+    response.headers['Retry-After'] = str(EVENTS_RETRY_MS // 1000)
+    return response, 503
+
+@app.route('/batches/<batch_id>/results', methods=['GET'])
+def stream_batch_results(batch_id):
+    """
+    Streams one NDJSON line per item as soon as its job finishes or fails,
+    then a summary line. The stream ends after BATCH_STREAM_TIMEOUT_SECONDS;
+    a summary with done=false means the client should request it again.
+    """
+    batch = job_queue.get_batch(batch_id)
+    if not batch:
+        return jsonify({'status': 'Error', 'message': 'Batch not found.'}), 404
+
+    def generate():
+        pending = list(batch['items'])
+        deadline = time.monotonic() + BATCH_STREAM_TIMEOUT_SECONDS
+        while pending and time.monotonic() < deadline:
+            still_pending = []
+            for item in pending:
+                view = _batch_item_view(item)
+                if view['status'] in (JOB_FINISHED, JOB_FAILED):
+                    yield json.dumps(view) + '\n'
+                else:
+                    still_pending.append(item)
+            pending = still_pending
+            if pending:
+                time.sleep(BATCH_POLL_INTERVAL)
+        yield json.dumps({'batchId': batch_id, 'done': not pending, 'pending': len(pending)}) + '\n'
+
+    return _stream_response(generate, 'application/x-ndjson') or _streams_busy()
+
+def _zip_response(filenames, archive_name):
+    """Streams the named artifacts as one stored ZIP."""
+    if not filenames:
+        return jsonify({'status': 'Error', 'message': 'No files to archive.'}), 400
+    if len(filenames) > ZIP_MAX_FILES:
+        return jsonify({'status': 'Error', 'message': f'At most {ZIP_MAX_FILES} files per archive'}), 400
+    try:
+        paths = resolve_artifacts(OUTPUT_DIR, filenames)
+    except FileNotFoundError as e:
+        logging.error(f"File not found for ZIP download: {e}")
+        return jsonify({'status': 'Error', 'message': f'File not found: {e}'}), 404
+    cache = get_result_cache(OUTPUT_DIR)
+    for path in paths:
+        cache.touch(os.path.basename(path)) # Keeps the janitor off files being archived
+    response = Response(stream_zip(paths), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+    return response
+
+@app.route('/downloads.zip', methods=['GET'])
+def download_zip():
+    """Streams a ZIP of the artifacts named by repeated ?file= parameters."""
+    filenames = request.args.getlist('file')
+    logging.info(f"Request to download {len(filenames)} files as ZIP")
+    return _zip_response(filenames, 'results.zip')
+
+@app.route('/batches/<batch_id>/zip', methods=['GET'])
+def download_batch_zip(batch_id):
+    """Streams a ZIP of every finished artifact in a batch."""
+    batch = job_queue.get_batch(batch_id)
+    if not batch:
+        return jsonify({'status': 'Error', 'message': 'Batch not found.'}), 404
+    views = [_batch_item_view(item) for item in batch['items']]
+    filenames = [view['filename'] for view in views if view['status'] == JOB_FINISHED and view.get('filename')]
+    return _zip_response(filenames, f"batch_{batch_id[:12]}.zip")
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Reports the status of a queued job, including downloadUrl once finished."""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'status': 'Error', 'message': 'Job not found.'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    Server-Sent Events for one job: a 'progress' event whenever its status,
+    stage, download or encode figures change, then a final 'done' event.
+    Each connection ends after EVENTS_STREAM_SECONDS and EventSource
+    reconnects, so a long job doesn't hold a request thread throughout.
+    """
+    if not job_queue.get(job_id):
+        return jsonify({'status': 'Error', 'message': 'Job not found.'}), 404
+
+    def generate():
+        last_sent, last_write = None, time.monotonic()
+        deadline = last_write + EVENTS_STREAM_SECONDS
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            job = job_queue.get(job_id)
+            if not job:
+                yield f"event: done\ndata: {json.dumps({'jobId': job_id, 'status': JOB_FAILED, 'error': 'Job expired.'})}\n\n"
+                return
+            data = job.to_dict()
+            if data['status'] in (JOB_FINISHED, JOB_FAILED):
+                yield f"event: done\ndata: {json.dumps(data)}\n\n"
+                return
+            payload = json.dumps({'jobId': job_id, 'status': data['status'], 'progress': data.get('progress', {})})
+            if payload != last_sent:
+                yield f"event: progress\ndata: {payload}\n\n"
+                last_sent, last_write = payload, time.monotonic()
+            elif time.monotonic() - last_write >= EVENTS_KEEPALIVE_SECONDS:
+                yield ': keepalive\n\n'
+                last_write = time.monotonic()
+            time.sleep(EVENTS_POLL_INTERVAL)
+
+    response = _stream_response(generate, 'text/event-stream')
+    if response is None:
+        return _streams_busy() # EventSource gives up on a 503, and the page falls back to polling
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let nginx buffer the stream
+    return response
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Lists all known jobs, newest first."""
+    jobs = job_queue.list()
+    return jsonify({'jobs': [job.to_dict() for job in jobs], 'counts': job_queue.counts()})
+
 @app.route('/downloads/<filename>')
 def download_file(filename):
     """Serves files from the output directory."""
     logging.info(f"Request to download file: {filename}")
     try:
-        return send_from_directory(OUTPUT_DIR, filename, as_attachment=True)
+        response = serve_artifact(OUTPUT_DIR, filename)
+        get_result_cache(OUTPUT_DIR).touch(filename) # Keeps the janitor off files being downloaded
+        return response
     except FileNotFoundError:
         logging.error(f"File not found for download: {filename}")
         return jsonify({'status': 'Error', 'message': 'File not found.'}), 404
@@ -111,6 +412,16 @@ def download_file(filename):
         logging.exception(f"Error serving file {filename}: {e}")
         return jsonify({'status': 'Error', 'message': 'Could not serve file.'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Exposes pipeline metrics in Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/tiers', methods=['GET'])
+def tier_stats():
+    """Reports what the media tier router has learned in this server process."""
+    return jsonify({'twitter': tweet_router.snapshot()})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Simple endpoint to verify the server is running and reachable."""
@@ -121,7 +432,24 @@ def health_check():
         'timestamp': str(datetime.now())
     })
 
+def drain(timeout, heartbeat=None):
+    """
+    Graceful shutdown for this server process: stops taking jobs, lets
+    queued and running ones finish within timeout seconds, then stops the
+    conversion and browser pools.
+    """
+    logging.info(f"Draining jobs (up to {timeout}s)...")
+    finished = job_queue.drain(timeout, heartbeat=heartbeat)
+    conversion_pool.shutdown(wait=finished)
+    browser_pool.shutdown()
+    logging.info("Drain complete." if finished else "Drain timed out; unfinished jobs were marked failed.")
+    return finished
+
+if multiprocessing.parent_process() is None:
+    _report_boot_time()
+
 if __name__ == '__main__':
     # Update logging before starting the server
     logging.info("Starting Flask server on http://127.0.0.1:5000")
+    logging.info("This is the development server; use 'python serve.py' for production.")
     app.run(debug=True, port=5000)
@@ -0,0 +1,477 @@
+"""
+Offline stage-level benchmark for the Twitter-to-GIF pipeline.
+
+Generates deterministic local fixtures (synthetic videos and image
+galleries), serves them from a local HTTP server in place of Twitter's
+CDN, stubs out yt-dlp's extraction step, and times each pipeline stage in
+its own process. Each output is also checked (frame and file counts), so
+a stage that gets faster by dropping frames fails instead of improving.
+Peak RSS is the largest single process (the stage or one of its ffmpeg
+children). Results are written as JSON so runs from different commits
+can be compared:
+
+    python benchmark.py --output base.json
+    python benchmark.py --output head.json
+    python benchmark.py --compare base.json head.json
+
+`--startup` instead measures how long a fresh interpreter takes to import
+the API server, with a per-module breakdown from `python -X importtime`.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import logging
+import platform
+import resource
+import statistics
+import subprocess
+import threading
+import multiprocessing
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+VIDEO_FIXTURES = [  # (name, width, height, seconds)
+    ('video_360p_3s', 640, 360, 3),
+    ('video_720p_3s', 1280, 720, 3),
+    ('video_720p_10s', 1280, 720, 10),
+    ('video_1080p_10s', 1920, 1080, 10),
+]
+GALLERY_FIXTURES = [  # (name, image count, width, height)
+    ('gallery_2x1080p', 2, 1920, 1080),
+    ('gallery_4x1080p', 4, 1920, 1080),
+    ('gallery_4x12mp', 4, 4000, 3000),
+]
+STAGES = {
+    'download_media': ('video', 'gallery'),
+    'convert_to_gif_ffmpeg': ('video',),
+    'convert_to_gif': ('video',),
+    'convert_images_to_gif_ffmpeg': ('gallery',),
+    'convert_images_to_gif': ('gallery',),
+}
+BENCH_TWEET_URL = 'https://x.com/bench/status/1'
+BOOT_TIME_TARGET_SECONDS = float(os.environ.get('BOOT_TIME_TARGET_SECONDS', 2.0)) # Same default as app.py
+STARTUP_REPORT_MODULES = 15 # Slowest top-level imports listed in the startup report
+RSS_SAMPLE_SECONDS = 0.01 # How often the stage process and its ffmpeg children are checked for peak RSS
+VIDEO_FPS = 15 # fps the video stages encode at
+FRAME_TOLERANCE = 2 # Allowed difference from the expected GIF frame count (rounding at clip ends)
+
+
+# --- Fixtures ---
+def make_video_fixture(path, width, height, seconds):
+    """Renders a deterministic H.264/AAC faststart mp4 from ffmpeg's test sources."""
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-threads', '1',
+        '-c:a', 'aac', '-movflags', '+faststart',
+        '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+        '-y', path
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def make_gallery_fixture(directory, count, width, height):
+    """Writes `count` deterministic images, alternating JPEG and PNG like real galleries."""
+    from PIL import Image
+    paths = []
+    for i in range(count):
+        # Mandelbrot renders are deterministic and compress like real photos rather than flat color
+        extent = (-2.0 + 0.1 * i, -1.2, 1.0 + 0.1 * i, 1.2)
+        img = Image.effect_mandelbrot((width, height), extent, 64).convert('RGB')
+        ext = '.jpg' if i % 2 == 0 else '.png'
+        path = os.path.join(directory, f"image_{i + 1}{ext}")
+        if ext == '.jpg':
+            img.save(path, quality=90)
+        else:
+            img.save(path)
+        img.close()
+        paths.append(path)
+    return paths
+
+
+def ensure_fixtures(fixtures_dir):
+    """Creates any missing fixtures and returns {name: {'kind', 'paths', ...}}."""
+    os.makedirs(fixtures_dir, exist_ok=True)
+    fixtures = {}
+    for name, width, height, seconds in VIDEO_FIXTURES:
+        path = os.path.join(fixtures_dir, f"{name}.mp4")
+        if not os.path.exists(path):
+            logging.info(f"Generating fixture {name}...")
+            make_video_fixture(path, width, height, seconds)
+        fixtures[name] = {'kind': 'video', 'paths': [path], 'width': width, 'height': height, 'seconds': seconds}
+    for name, count, width, height in GALLERY_FIXTURES:
+        directory = os.path.join(fixtures_dir, name)
+        if not os.path.isdir(directory):
+            logging.info(f"Generating fixture {name}...")
+            os.makedirs(directory)
+            make_gallery_fixture(directory, count, width, height)
+        paths = sorted(os.path.join(directory, f) for f in os.listdir(directory))
+        fixtures[name] = {'kind': 'gallery', 'paths': paths, 'width': width, 'height': height}
+    return fixtures
+
+
+# --- Local stand-in for the network ---
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(fixtures_dir):
+    """Serves fixtures over HTTP on a free localhost port; returns (server, base_url)."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(QuietHandler, directory=fixtures_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def fake_info_dict(fixture, fixtures_dir, base_url):
+    """A yt-dlp style info dict pointing at the local server instead of Twitter."""
+    def url_for(path):
+        return f"{base_url}/{os.path.relpath(path, fixtures_dir).replace(os.sep, '/')}"
+
+    info = {'id': '1', 'title': 'bench', 'extractor': 'bench', 'extractor_key': 'Bench',
+            'webpage_url': BENCH_TWEET_URL}
+    if fixture['kind'] == 'video':
+        info['formats'] = [{
+            'format_id': 'bench', 'url': url_for(fixture['paths'][0]), 'ext': 'mp4', 'protocol': 'http',
+            'vcodec': 'avc1', 'acodec': 'mp4a', 'width': fixture['width'], 'height': fixture['height'],
+        }]
+    else:
+        info['entries'] = [{'url': url_for(p), 'vcodec': 'none'} for p in fixture['paths']]
+    return info
+
+
+# --- Measurement helpers ---
+def process_peak_rss_kb(pid='self'):
+    """
+    VmHWM of one process: its own peak RSS since it started (or since
+    reset_peak_rss). Unlike ru_maxrss it doesn't carry over the parent's
+    peak across fork/exec. None where /proc isn't available.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Resets this process's VmHWM so it covers only what runs next (Linux 4.0+)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def descendant_pids(pid):
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children") as f:
+                    children = [int(child) for child in f.read().split()]
+                pids.extend(children)
+                pending.extend(children)
+        except (OSError, ValueError):
+            continue
+    return pids
+
+
+class PeakRssSampler:
+    """
+    Tracks the largest single-process peak RSS among this process and every
+    process it spawns (ffmpeg), by polling each one's VmHWM. VmHWM never
+    decreases, so polling only misses growth in a child's last few ms.
+    """
+
+    def __init__(self):
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        reset_peak_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def peak_kb(self):
+        return max(self.peaks.values(), default=None)
+
+    def _sample(self):
+        pid = os.getpid()
+        for target in [pid] + descendant_pids(pid):
+            peak = process_peak_rss_kb(target)
+            if peak is not None:
+                self.peaks[target] = max(peak, self.peaks.get(target, 0))
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self._sample()
+
+
+def count_frames(path):
+    """Number of video frames in path according to ffprobe, or None if it can't be read."""
+    try:
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-count_frames', '-select_streams', 'v:0',
+             '-show_entries', 'stream=nb_read_frames', '-of', 'csv=p=0', path],
+            check=True, capture_output=True, text=True).stdout
+        return int(out.strip().splitlines()[0])
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError, IndexError):
+        return None
+
+
+def check_outputs(stage, fixture, outputs):
+    """
+    Verifies a stage produced the right thing, not just something: one file
+    per source for download_media, one frame per gallery image, and about
+    seconds * VIDEO_FPS frames for video GIFs. Returns (frames, error).
+    """
+    if stage == 'download_media':
+        if len(outputs) != len(fixture['paths']):
+            return None, f"expected {len(fixture['paths'])} files, got {len(outputs)}"
+        return None, None
+    frames = count_frames(outputs[0])
+    if frames is None:
+        return None, 'output is not a readable animation'
+    if fixture['kind'] == 'gallery':
+        expected, tolerance = len(fixture['paths']), 0
+    elif stage == 'convert_to_gif':
+        return frames, None # MoviePy picks its own frame timing
+    else:
+        expected, tolerance = fixture['seconds'] * VIDEO_FPS, FRAME_TOLERANCE
+    if abs(frames - expected) > tolerance:
+        return frames, f"expected {expected} frames, got {frames}"
+    return frames, None
+
+
+# --- Stage runner (executes in a fresh process per measurement) ---
+def run_stage(stage, fixture, fixtures_dir, base_url, work_dir, results):
+    import TwitterLinktoGIF as pipeline
+
+    inputs = fixture['paths']
+    output_path = os.path.join(work_dir, 'out.gif')
+    if stage == 'download_media':
+        info = fake_info_dict(fixture, fixtures_dir, base_url)
+        pipeline.cached_extract_info = lambda ydl, url, key: info
+        call = lambda: pipeline.download_media(BENCH_TWEET_URL, work_dir)
+    elif stage == 'convert_to_gif_ffmpeg':
+        call = lambda: pipeline.convert_to_gif_ffmpeg(inputs[0], output_path, fps=15, width=640)
+    elif stage == 'convert_to_gif':
+        call = lambda: pipeline.convert_to_gif(inputs[0], output_path)
+    elif stage == 'convert_images_to_gif_ffmpeg':
+        call = lambda: pipeline.convert_images_to_gif_ffmpeg(inputs, output_path)
+    else:
+        call = lambda: pipeline.convert_images_to_gif(inputs, output_path)
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with PeakRssSampler() as sampler:
+        wall_start = time.perf_counter()
+        result = call()
+        wall = time.perf_counter() - wall_start
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if stage == 'download_media':
+        _, paths = result
+        outputs = paths or []
+    else:
+        outputs = [result] if result else []
+    frames, error = check_outputs(stage, fixture, outputs) if outputs else (None, 'no output')
+    peak_rss_kb = sampler.peak_kb()
+    if peak_rss_kb is None:
+        # No /proc: fall back to this process's ru_maxrss (KiB on Linux, bytes on macOS)
+        peak_rss_kb = self_after.ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+    results.put({
+        'ok': error is None,
+        'error': error,
+        'frames': frames,
+        'wall_s': wall,
+        'cpu_s': (self_after.ru_utime + self_after.ru_stime - self_before.ru_utime - self_before.ru_stime)
+                 + (children_after.ru_utime + children_after.ru_stime
+                    - children_before.ru_utime - children_before.ru_stime),
+        'peak_rss_kb': peak_rss_kb,
+        'output_bytes': sum(os.path.getsize(p) for p in outputs if os.path.exists(p)),
+    })
+
+
+def measure(stage, fixture, fixtures_dir, base_url, work_root):
+    """Runs one stage on one fixture in a fresh process and returns its measurements."""
+    import tempfile
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    with tempfile.TemporaryDirectory(dir=work_root) as work_dir:
+        proc = ctx.Process(target=run_stage, args=(stage, fixture, fixtures_dir, base_url, work_dir, results))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            return {'ok': False, 'error': f"exit code {proc.exitcode}"}
+        return results.get()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], check=True, capture_output=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def run_benchmarks(fixtures_dir, stages, repeat):
+    fixtures = ensure_fixtures(fixtures_dir)
+    server, base_url = start_fixture_server(fixtures_dir)
+    work_root = os.path.join(fixtures_dir, '_work')
+    os.makedirs(work_root, exist_ok=True)
+    rows = []
+    try:
+        for stage in stages:
+            for name, fixture in fixtures.items():
+                if fixture['kind'] not in STAGES[stage]:
+                    continue
+                runs = [measure(stage, fixture, fixtures_dir, base_url, work_root) for _ in range(repeat)]
+                ok_runs = [r for r in runs if r.get('ok')]
+                row = {'stage': stage, 'fixture': name, 'runs': len(runs), 'ok_runs': len(ok_runs)}
+                if ok_runs:
+                    for metric in ('wall_s', 'cpu_s', 'peak_rss_kb', 'output_bytes'):
+                        row[metric] = statistics.median(r[metric] for r in ok_runs)
+                    row['frames'] = ok_runs[0].get('frames')
+                errors = sorted({r['error'] for r in runs if r.get('error')})
+                if errors:
+                    row['errors'] = errors
+                logging.info(f"{stage:30s} {name:18s} " + (
+                    f"wall={row['wall_s']:.3f}s cpu={row['cpu_s']:.3f}s rss={row['peak_rss_kb']}KiB "
+                    f"out={row['output_bytes']}B frames={row['frames']}" if ok_runs else f"FAILED {errors}"))
+                rows.append(row)
+    finally:
+        server.shutdown()
+    return {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpus': os.cpu_count()},
+        'repeat': repeat,
+        'results': rows,
+    }
+
+
+def parse_importtime(stderr):
+    """Returns {module: cumulative_us} for top-level imports from `-X importtime` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        if name.startswith('  '):  # Nested import; already counted in its parent's cumulative time
+            continue
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure_startup(repeat, target):
+    """Times `import app` in fresh interpreters and reports the slowest top-level imports."""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, BROWSER_POOL_WARM='0')  # Don't launch Chrome while measuring
+    walls, modules = [], {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                              cwd=repo_dir, env=env, capture_output=True, text=True)
+        walls.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            logging.error(f"Importing app failed:\n{proc.stderr[-2000:]}")
+            return {'ok': False}
+        modules = parse_importtime(proc.stderr)
+    boot_s = statistics.median(walls)
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:STARTUP_REPORT_MODULES]
+    print(f"{'module':40s} {'cumulative':>12s}")
+    for name, cumulative_us in slowest:
+        print(f"{name:40s} {cumulative_us / 1e6:11.3f}s")
+    verdict = 'within' if boot_s <= target else 'OVER'
+    print(f"Boot (interpreter + import app): {boot_s:.3f}s, {verdict} the {target:.2f}s target")
+    return {'ok': True, 'boot_s': boot_s, 'target_s': target,
+            'slowest_imports': [{'module': n, 'cumulative_s': us / 1e6} for n, us in slowest]}
+
+
+def compare(base_path, head_path):
+    """Prints head/base ratios for every stage+fixture present in both result files."""
+    with open(base_path) as f:
+        base_report = json.load(f)
+    with open(head_path) as f:
+        head_report = json.load(f)
+    base_boot = base_report.get('startup', {}).get('boot_s')
+    head_boot = head_report.get('startup', {}).get('boot_s')
+    if base_boot and head_boot:
+        print(f"startup boot: {base_boot:.3f}s -> {head_boot:.3f}s ({head_boot / base_boot:.2f}x)")
+    base = {(r['stage'], r['fixture']): r for r in base_report.get('results', [])}
+    head = {(r['stage'], r['fixture']): r for r in head_report.get('results', [])}
+    print(f"{'stage':30s} {'fixture':18s} {'wall':>8s} {'cpu':>8s} {'rss':>8s} {'bytes':>8s}")
+    for key in sorted(base.keys() & head.keys()):
+        b, h = base[key], head[key]
+        ratios = []
+        for metric in ('wall_s', 'cpu_s', 'peak_rss_kb', 'output_bytes'):
+            if b.get(metric) and h.get(metric) is not None:
+                ratios.append(f"{h[metric] / b[metric]:7.2f}x")
+            else:
+                ratios.append(f"{'n/a':>8s}")
+        print(f"{key[0]:30s} {key[1]:18s} " + ' '.join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages against synthetic local fixtures.')
+    parser.add_argument('--fixtures-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_fixtures'),
+                        help='Where generated fixtures are kept between runs')
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES), default=list(STAGES),
+                        help='Stages to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage/fixture; the median is reported')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='Compare two result files and exit')
+    parser.add_argument('--startup', action='store_true', help='Measure API server import time instead of stages')
+    parser.add_argument('--boot-target', type=float, default=BOOT_TIME_TARGET_SECONDS,
+                        help='Boot time budget in seconds for --startup (exit status 1 when exceeded)')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.startup:
+        startup = measure_startup(args.repeat, args.boot_target)
+        with open(args.output, 'w') as f:
+            json.dump({'revision': git_revision(), 'timestamp': time.time(), 'startup': startup}, f, indent=2)
+        if not startup['ok'] or startup['boot_s'] > args.boot_target:
+            sys.exit(1)
+        return
+
+    report = run_benchmarks(os.path.abspath(args.fixtures_dir), args.stages, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} results to {args.output}")
+    failed = [f"{r['stage']}/{r['fixture']}: {', '.join(r['errors'])}" for r in report['results'] if r.get('errors')]
+    if failed:
+        logging.error("Output checks failed:\n" + '\n'.join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
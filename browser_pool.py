@@ -0,0 +1,136 @@
+import os
+import atexit
+import logging
+import threading
+import importlib.util
+from contextlib import contextmanager
+
+# Selenium itself is imported on first launch; it is slow to import and only the fallback tier needs it
+SELENIUM_AVAILABLE = importlib.util.find_spec('selenium') is not None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 2))  # Max concurrent browser sessions
+BROWSER_POOL_WARM = int(os.environ.get('BROWSER_POOL_WARM', 1))  # Sessions launched ahead of demand
+BROWSER_MAX_USES = int(os.environ.get('BROWSER_MAX_USES', 25))  # Recycle a browser after this many pages
+BROWSER_ACQUIRE_TIMEOUT = int(os.environ.get('BROWSER_ACQUIRE_TIMEOUT', 60))
+
+
+def make_chrome_options():
+    """Headless Chrome options used for every pooled session."""
+    from selenium.webdriver.chrome.options import Options
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")  # Run in headless mode
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--window-size=1920,1080")
+    return chrome_options
+
+
+class BrowserPool:
+    """
+    Keeps pre-launched headless Chrome sessions for reuse across requests.
+    At most `size` sessions are in use at once; idle ones are health-checked
+    before being handed out and recycled after `max_uses` pages.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []  # (driver, uses) pairs ready to hand out
+        self._lock = threading.Lock()
+
+    def warm(self, count=BROWSER_POOL_WARM):
+        """Launches browsers until `count` idle sessions are ready."""
+        while True:
+            with self._lock:
+                if len(self._idle) >= min(count, self.size):
+                    return
+            driver = self._launch()
+            if driver is None:
+                return
+            with self._lock:
+                self._idle.append((driver, 0))
+
+    @contextmanager
+    def session(self, timeout=BROWSER_ACQUIRE_TIMEOUT):
+        """Yields a healthy WebDriver, returning it to the pool afterwards."""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No browser session became free within {timeout}s")
+        driver, uses = None, 0
+        try:
+            driver, uses = self._checkout()
+            if driver is None:
+                raise RuntimeError("Could not launch a browser session")
+            yield driver
+        finally:
+            if driver is not None:
+                self._checkin(driver, uses + 1)
+            self._slots.release()
+
+    def shutdown(self):
+        """Quits every idle browser."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver, _ in idle:
+            self._quit(driver)
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                driver, uses = self._idle.pop()
+            if self._is_healthy(driver):
+                return driver, uses
+            logging.warning("Discarding unhealthy pooled browser session.")
+            self._quit(driver)
+        return self._launch(), 0
+
+    def _checkin(self, driver, uses):
+        if uses >= self.max_uses:
+            logging.info(f"Recycling browser session after {uses} uses.")
+            self._quit(driver)
+            return
+        try:
+            # Drop the page so an idle browser doesn't keep running its scripts
+            driver.get('about:blank')
+        except Exception:
+            self._quit(driver)
+            return
+        with self._lock:
+            self._idle.append((driver, uses))
+
+    def _launch(self):
+        if not SELENIUM_AVAILABLE:
+            return None
+        from selenium import webdriver
+        from selenium.common.exceptions import WebDriverException
+        try:
+            logging.info("Launching headless browser session...")
+            return webdriver.Chrome(options=make_chrome_options())
+        except WebDriverException as e:
+            logging.error(f"Could not launch headless browser: {e}")
+            return None
+
+    @staticmethod
+    def _is_healthy(driver):
+        try:
+            return driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.shutdown)
@@ -0,0 +1,115 @@
+import os
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cpu_info import available_cpus
+from progress import ffmpeg_progress_args, tail_ffmpeg_progress, call_with_ffmpeg_target
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# --- Constants ---
+CPU_COUNT = available_cpus()
+CONVERSION_WORKERS = int(os.environ.get('CONVERSION_WORKERS', max(1, CPU_COUNT // 2)))  # Concurrent encodes
+FFMPEG_THREADS = int(os.environ.get('FFMPEG_THREADS', max(1, CPU_COUNT // CONVERSION_WORKERS)))  # Per encode
+
+
+def ffmpeg_thread_args():
+    """
+    Global ffmpeg options that cap one encode at its share of the CPU, so
+    CONVERSION_WORKERS encodes together use about CPU_COUNT threads.
+    Also adds -progress reporting when the running job has a listener.
+    """
+    return ['-threads', str(FFMPEG_THREADS), '-filter_threads', str(FFMPEG_THREADS), *ffmpeg_progress_args()]
+
+
+class ConversionPool:
+    """
+    Runs CPU-heavy conversions on a dedicated process pool sized to the
+    machine, separate from the HTTP/job threads. Callers beyond the limit
+    wait for a free slot instead of all encoding at once.
+    """
+
+    def __init__(self, workers=CONVERSION_WORKERS):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds one conversion slot for work that has to stay in this process,
+        such as an ffmpeg fed from a live download. Yields the ffmpeg
+        progress file for the current job (None if it isn't reporting).
+        """
+        with self._lock:
+            self._waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self._waiting -= 1
+            self._running += 1
+        try:
+            with tail_ffmpeg_progress() as progress_path:
+                yield progress_path
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def run(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) in a pool process and returns its result."""
+        with self.slot() as progress_path:
+            try:
+                if progress_path:
+                    future = self._get_executor().submit(call_with_ffmpeg_target, progress_path, func, args, kwargs)
+                else:
+                    future = self._get_executor().submit(func, *args, **kwargs)
+                return future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); start a fresh pool for the next job
+                logging.error(f"Conversion worker died while running {func.__name__}; restarting pool.")
+                self._reset_executor()
+                raise
+
+    def stats(self):
+        """Returns (waiting, running) conversion counts."""
+        with self._lock:
+            return self._waiting, self._running
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: forking a process that already runs HTTP and job threads can deadlock
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False)
+
+
+conversion_pool = ConversionPool()
+
+
+def run_conversion(func, *args, **kwargs):
+    """Runs a conversion function on the shared conversion pool."""
+    return conversion_pool.run(func, *args, **kwargs)
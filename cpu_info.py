@@ -0,0 +1,9 @@
+import os
+
+
+def available_cpus():
+    """CPUs this process may run on (respects affinity/cgroup pinning where the OS exposes it)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
@@ -0,0 +1,138 @@
+import os
+import time
+import hashlib
+import logging
+import mimetypes
+import zipfile
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import quote
+
+from flask import Response, send_file
+from werkzeug.security import safe_join
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+# '' streams from Python; 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) hands the file to the proxy
+OFFLOAD_MODE = os.environ.get('OFFLOAD_MODE', '').lower()
+OFFLOAD_URL_PREFIX = os.environ.get('OFFLOAD_URL_PREFIX', '/protected-downloads/')  # nginx `internal` location
+ETAG_CACHE_ENTRIES = int(os.environ.get('ETAG_CACHE_ENTRIES', 4096))
+HASH_CHUNK_SIZE = 1024 * 1024
+ZIP_CHUNK_SIZE = 256 * 1024  # Read/yield size when streaming archives; bounds per-response memory
+
+# Older mimetypes tables lack WebP; downloads and offloaded responses need the right Content-Type
+mimetypes.add_type('image/webp', '.webp')
+
+_etags = OrderedDict()  # (path, inode, size, mtime_ns) -> etag
+_etags_lock = threading.Lock()
+
+
+def content_etag(path, st=None):
+    """
+    Strong ETag from the file's content (sha256). Hashes are remembered
+    per (path, inode, size, mtime) so each artifact is read once; a
+    republished file gets a new inode and is hashed again.
+    """
+    st = st or os.stat(path)
+    key = (path, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag:
+            _etags.move_to_end(key)
+            return etag
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()[:32]
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > ETAG_CACHE_ENTRIES:
+            _etags.popitem(last=False)
+    return etag
+
+
+def _offload_response(filename, path, etag):
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    if OFFLOAD_MODE == 'x-accel-redirect':
+        response.headers['X-Accel-Redirect'] = OFFLOAD_URL_PREFIX.rstrip('/') + '/' + quote(filename)
+    else:
+        response.headers['X-Sendfile'] = path
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    response.set_etag(etag)
+    return response
+
+
+def serve_artifact(directory, filename):
+    """
+    Returns a download response for directory/filename, raising
+    FileNotFoundError if it doesn't exist.
+
+    Range and If-None-Match/If-Range requests are answered by Werkzeug
+    against the content ETag. The body goes out as a file wrapper, which
+    gunicorn sends with os.sendfile for full responses. With OFFLOAD_MODE
+    set only headers are returned and the proxy streams the file.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise FileNotFoundError(filename)
+    st = os.stat(path)
+    etag = content_etag(path, st)
+    if OFFLOAD_MODE in ('x-accel-redirect', 'x-sendfile'):
+        return _offload_response(filename, path, etag)
+    return send_file(path, as_attachment=True, download_name=filename, conditional=True, etag=etag,
+                     last_modified=st.st_mtime)
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that hands ZipFile output to a generator."""
+
+    def __init__(self):
+        self.chunks = deque()
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        while self.chunks:
+            yield self.chunks.popleft()
+
+
+def resolve_artifacts(directory, filenames):
+    """Maps filenames to paths inside directory, raising FileNotFoundError for any that don't exist."""
+    paths = []
+    for filename in dict.fromkeys(filenames):  # Drop repeats, keep order
+        path = safe_join(directory, filename)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(filename)
+        paths.append(path)
+    return paths
+
+
+def stream_zip(paths):
+    """
+    Yields a ZIP archive of paths chunk by chunk, read straight from the
+    files. Entries are stored, not deflated: GIF/MP4/WebM are already
+    compressed, so this only costs the CRC. Nothing is staged on disk and
+    memory stays at about one chunk.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            st = os.stat(path)
+            info = zipfile.ZipInfo(os.path.basename(path), date_time=time.localtime(st.st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = st.st_size  # Lets zipfile pick Zip64 up front for files over 4 GiB
+            with open(path, 'rb') as src, archive.open(info, mode='w') as entry:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b''):
+                    entry.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()  # Central directory
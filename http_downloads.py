@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))  # Keep-alive connections kept per host
+PER_HOST_CONCURRENCY = int(os.environ.get('PER_HOST_CONCURRENCY', 4))  # Simultaneous fetches per host
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # Bytes read from the socket per iteration
+WRITE_BUFFER_SIZE = 1024 * 1024  # Buffered file writes so each chunk isn't a syscall
+DEFAULT_TIMEOUT = 30
+RESUME_ATTEMPTS = int(os.environ.get('RESUME_ATTEMPTS', 3))  # Tries per file when a transfer breaks off midway
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide requests.Session with a keep-alive connection pool."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def _host_limit(url):
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        limit = _host_limits.get(host)
+        if limit is None:
+            limit = threading.BoundedSemaphore(PER_HOST_CONCURRENCY)
+            _host_limits[host] = limit
+        return limit
+
+
+def fetch_to_file(url, path_for_response, headers=None, timeout=DEFAULT_TIMEOUT, resume_dir=None):
+    """
+    Streams url to disk over the pooled session.
+    path_for_response(response) picks the destination, so callers can choose
+    an extension from the Content-Type. Returns the written path; raises
+    requests.exceptions.RequestException on failure after removing any partial file.
+    With resume_dir, partial data is kept there instead and later calls
+    continue it with a Range request (see fetch_resumable).
+    """
+    if resume_dir:
+        return fetch_resumable(url, path_for_response, resume_dir, headers=headers, timeout=timeout)
+    path = None
+    with _host_limit(url):
+        try:
+            with get_session().get(url, stream=True, timeout=timeout, headers=headers) as response:
+                response.raise_for_status()
+                path = path_for_response(response)
+                with open(path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+            return path
+        except (requests.exceptions.RequestException, OSError):
+            if path and os.path.exists(path):
+                try: os.remove(path)
+                except OSError: pass
+            raise
+
+
+def fetch_resumable(url, path_for_response, resume_dir, headers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Downloads url into resume_dir so an interrupted transfer can continue
+    where it stopped, within this call or a later one.
+
+    Bytes go to a .part file next to a small JSON sidecar that records the
+    server's validator (strong ETag or Last-Modified) and total size. A
+    resume sends Range plus If-Range, so the server only continues the
+    transfer if the file is unchanged. It is used only when the 206 starts
+    exactly at our offset; otherwise the download restarts from zero. The
+    finished file must match the expected size before it is moved into
+    place, and a later call returns it without any request.
+    """
+    stem = os.path.join(resume_dir, 'dl-' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:16])
+    part_path, meta_path = f"{stem}.part", f"{stem}.json"
+    meta = _read_meta(meta_path)
+    if meta.get('complete') and os.path.exists(meta['path']) and os.path.getsize(meta['path']) == meta['size']:
+        logging.info(f"Reusing completed download of {url}")
+        return meta['path']
+
+    for attempt in range(1, RESUME_ATTEMPTS + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) and meta.get('validator') else 0
+        request_headers = dict(headers or {}, **{'Accept-Encoding': 'identity'})  # Byte offsets must match the file
+        if offset:
+            request_headers['Range'] = f"bytes={offset}-"
+            request_headers['If-Range'] = meta['validator']
+        try:
+            with _host_limit(url), get_session().get(url, stream=True, timeout=timeout,
+                                                     headers=request_headers) as response:
+                if offset and response.status_code == 416:
+                    # Our offset is past the server's end; the partial data doesn't match it
+                    os.remove(part_path)
+                    meta = {}
+                    continue
+                response.raise_for_status()
+                start, total = _content_range(response)
+                if response.status_code == 206:
+                    if not offset or start != offset:
+                        # Not the range we asked for; drop the partial data and start over
+                        if os.path.exists(part_path):
+                            os.remove(part_path)
+                        meta = {}
+                        continue
+                    logging.info(f"Resuming {url} at byte {offset} of {total or 'unknown'}")
+                    mode = 'ab'
+                else:
+                    if offset:
+                        logging.info(f"Server won't resume {url}; starting over")
+                    mode, total = 'wb', _int_header(response, 'Content-Length')
+                    meta = {'url': url, 'validator': _validator(response), 'total': total}
+                    _write_meta(meta_path, meta)
+                with open(part_path, mode, buffering=WRITE_BUFFER_SIZE) as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                size = os.path.getsize(part_path)
+                expected = total or meta.get('total')
+                if expected and size != expected:
+                    if size > expected:
+                        os.remove(part_path)  # Can't be trusted; never resume from it
+                    raise requests.exceptions.ContentDecodingError(
+                        f"Downloaded {size} bytes of {url}, expected {expected}")
+                path = path_for_response(response)
+            os.replace(part_path, path)
+            _write_meta(meta_path, {'url': url, 'complete': True, 'path': path, 'size': os.path.getsize(path)})
+            return path
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.ContentDecodingError, requests.exceptions.Timeout) as e:
+            if attempt == RESUME_ATTEMPTS:
+                raise
+            logging.warning(f"Transfer of {url} broke off ({e}); resuming (attempt {attempt + 1})")
+    raise requests.exceptions.RequestException(f"Could not download {url} in {RESUME_ATTEMPTS} attempts")
+
+
+def _content_range(response):
+    """Returns (first byte, total size) from a Content-Range header, or (None, None)."""
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2)) if match.group(2) != '*' else None
+
+
+def _int_header(response, name):
+    value = response.headers.get(name)
+    return int(value) if value and value.isdigit() else None
+
+
+def _validator(response):
+    # Weak ETags can't be used with If-Range
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path, meta):
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+
+def fetch_all(urls, path_for_response, headers=None, timeout=DEFAULT_TIMEOUT, fail_fast=True, resume_dir=None):
+    """
+    Fetches several URLs in parallel, bounded per host.
+    path_for_response(index, response) picks each destination.
+    Returns a list of (path, error) pairs in the same order as urls.
+    With fail_fast, the first error cancels downloads that have not started yet.
+    resume_dir is passed on to fetch_to_file.
+    """
+    if not urls:
+        return []
+
+    results = [(None, None)] * len(urls)
+    failed = threading.Event()
+
+    def fetch(index, url):
+        if fail_fast and failed.is_set():
+            return
+        try:
+            path = fetch_to_file(url, lambda response: path_for_response(index, response),
+                                 headers=headers, timeout=timeout, resume_dir=resume_dir)
+            results[index] = (path, None)
+        except Exception as e:
+            results[index] = (None, e)
+            failed.set()
+
+    with ThreadPoolExecutor(max_workers=min(len(urls), HTTP_POOL_SIZE)) as executor:
+        for index, url in enumerate(urls):
+            executor.submit(fetch, index, url)
+    return results
@@ -0,0 +1,269 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from progress import reporting_to
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 3600))  # Keep finished jobs for an hour
+JOB_STATE_DIR = os.environ.get('JOB_STATE_DIR')  # Shared job snapshots so any server worker can answer status polls
+PROGRESS_SAVE_INTERVAL = 0.5  # Min seconds between progress snapshots written to JOB_STATE_DIR
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+
+class Job:
+    """A single unit of work submitted to the JobQueue."""
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {}  # Latest stage, download and encode figures reported while running
+        self.progress_saved_at = 0
+
+    def to_dict(self):
+        """Returns a JSON-serializable view of the job for the API."""
+        data = {
+            'jobId': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'params': self.params,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+        if self.progress:
+            data['progress'] = dict(self.progress)
+        if self.result:
+            data.update(self.result)
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class JobSnapshot:
+    """A job owned by another server process, as last written to the shared state directory."""
+
+    def __init__(self, data):
+        self.id = data['jobId']
+        self.status = data['status']
+        self.created_at = data['createdAt']
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a bounded worker pool and keeps their status
+    so HTTP handlers can return immediately and clients can poll.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_SECONDS, state_dir=JOB_STATE_DIR):
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._jobs = {}
+        self._batches = {}  # batch ID -> {'batchId', 'createdAt', 'items'}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, params, func, *args, **kwargs):
+        """
+        Queues func(*args, **kwargs) and returns the Job immediately.
+        func should return a dict merged into the job's status, or None on failure.
+        """
+        job = Job(kind, params)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+        self._save(job)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        logging.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def create_batch(self, items):
+        """
+        Records a batch: items is a list of per-item dicts, each carrying
+        either a 'jobId' or an 'error'. Returns the stored batch.
+        """
+        batch = {'batchId': uuid.uuid4().hex, 'createdAt': time.time(), 'items': items}
+        with self._lock:
+            self._batches[batch['batchId']] = batch
+        self._save_record(os.path.join('batches', f"{batch['batchId']}.json"), batch)
+        return batch
+
+    def get_batch(self, batch_id):
+        """Returns the batch with the given ID, or None if unknown or expired."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+        if batch is None and self.state_dir and re.fullmatch(r'[0-9a-f]{32}', batch_id):
+            try:
+                with open(os.path.join(self.state_dir, 'batches', f"{batch_id}.json")) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+        return batch
+
+    def get(self, job_id):
+        """Returns the Job with the given ID, or None if unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state_dir and re.fullmatch(r'[0-9a-f]{32}', job_id):
+            return self._load(os.path.join(self.state_dir, f"{job_id}.json"))
+        return job
+
+    def list(self):
+        """Returns all known jobs, newest first."""
+        with self._lock:
+            self._prune_locked()
+            jobs = {job.id: job for job in self._jobs.values()}
+        if self.state_dir:
+            for entry in os.scandir(self.state_dir):
+                job_id = entry.name[:-len('.json')]
+                if entry.name.endswith('.json') and job_id not in jobs:
+                    snapshot = self._load(entry.path)
+                    if snapshot:
+                        jobs[job_id] = snapshot
+        return sorted(jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def counts(self):
+        """Returns the number of jobs in each status."""
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_FINISHED: 0, JOB_FAILED: 0}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def shutdown(self, wait=True):
+        """Stops accepting work; with wait=True blocks until running jobs finish."""
+        self._executor.shutdown(wait=wait)
+
+    def drain(self, timeout, heartbeat=None):
+        """
+        Stops accepting work and waits up to timeout seconds for queued and
+        running jobs to finish, calling heartbeat() about once a second.
+        Jobs still unfinished at the deadline are marked failed so pollers
+        get an answer. Returns True if everything finished.
+        """
+        self._executor.shutdown(wait=False)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                pending = [job for job in self._jobs.values() if job.status in (JOB_QUEUED, JOB_RUNNING)]
+            if not pending:
+                return True
+            if heartbeat:
+                heartbeat()
+            time.sleep(1)
+        for job in pending:
+            logging.warning(f"Abandoning {job.kind} job {job.id} ({job.status}) at shutdown")
+            job.error = 'The server restarted before this job finished. Please submit it again.'
+            job.status = JOB_FAILED
+            job.finished_at = time.time()
+            self._save(job)
+        return False
+
+    def _run(self, job, func, args, kwargs):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        logging.info(f"Starting {job.kind} job {job.id}")
+        try:
+            with reporting_to(partial(self._update_progress, job)):
+                result = func(*args, **kwargs)
+            if result:
+                job.result = result
+                job.status = JOB_FINISHED
+            else:
+                job.error = 'Processing failed. Check backend logs.'
+                job.status = JOB_FAILED
+        except Exception as e:
+            logging.exception(f"Job {job.id} raised an unexpected error: {e}")
+            job.error = f'An internal server error occurred: {e}'
+            job.status = JOB_FAILED
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            logging.info(f"{job.kind} job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
+
+    def _update_progress(self, job, **fields):
+        stage_changed = 'stage' in fields and fields['stage'] != job.progress.get('stage')
+        if stage_changed:
+            job.progress = {}  # Byte and frame counts belong to the previous stage
+        job.progress.update((k, v) for k, v in fields.items() if v is not None)
+        now = time.monotonic()
+        # Other server processes read progress from the snapshot; stage changes always go out
+        if stage_changed or now - job.progress_saved_at >= PROGRESS_SAVE_INTERVAL:
+            job.progress_saved_at = now
+            self._save(job)
+
+    def _save(self, job):
+        self._save_record(f"{job.id}.json", job.to_dict())
+
+    def _save_record(self, name, data):
+        if not self.state_dir:
+            return
+        path = os.path.join(self.state_dir, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not save job state {path}: {e}")
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path) as f:
+                return JobSnapshot(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _prune_locked(self):
+        # Drop finished jobs older than the retention window so the table stays bounded
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        for batch_id in [b for b, batch in self._batches.items() if batch['createdAt'] < cutoff]:
+            del self._batches[batch_id]
+        if self.state_dir:
+            # Snapshots are shared, so any process may expire them (including ones left by dead workers)
+            for directory in (self.state_dir, os.path.join(self.state_dir, 'batches')):
+                if not os.path.isdir(directory):
+                    continue
+                for entry in os.scandir(directory):
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
@@ -0,0 +1,165 @@
+import os
+import copy
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', 512))  # Entries kept in memory
+METADATA_CACHE_DB = os.environ.get('METADATA_CACHE_DB')  # Optional SQLite file shared across workers
+METADATA_TTL_SECONDS = int(os.environ.get('METADATA_TTL_SECONDS', 24 * 3600))  # Titles, durations, etc.
+MEDIA_URL_TTL_SECONDS = int(os.environ.get('MEDIA_URL_TTL_SECONDS', 30 * 60))  # Signed media URLs expire sooner
+
+# Fields that carry signed media URLs and go stale long before the rest of the info dict
+VOLATILE_FIELDS = (
+    'url', 'formats', 'requested_formats', 'entries',
+    'thumbnails', 'thumbnail', 'http_headers', 'manifest_url',
+)
+
+
+def field_ttl(name):
+    """Returns how long a given info-dict field stays valid, in seconds."""
+    return MEDIA_URL_TTL_SECONDS if name in VOLATILE_FIELDS else METADATA_TTL_SECONDS
+
+
+class MetadataCache:
+    """
+    Caches yt-dlp info dicts by normalized media ID (e.g. 'twitter:<id>').
+    An in-memory LRU tier sits in front of an optional SQLite tier, so
+    several worker processes can share results. Each field expires on its
+    own schedule; get() only returns an entry while the fields the caller
+    needs are still fresh.
+    """
+
+    def __init__(self, max_entries=METADATA_CACHE_SIZE, db_path=METADATA_CACHE_DB):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._open_db()
+
+    def get(self, key, required_fields=VOLATILE_FIELDS):
+        """
+        Returns a copy of the cached info dict for key with expired fields
+        dropped, or None if it is missing or any required field present at
+        store time has expired.
+        """
+        now = time.time()
+        with self._lock:
+            fields = self._memory.get(key)
+            if fields is not None:
+                self._memory.move_to_end(key)
+        if fields is None:
+            fields = self._db_get(key)
+            if fields is None:
+                return None
+            self._remember(key, fields)
+
+        fresh = {name: value for name, (expires_at, value) in fields.items() if expires_at > now}
+        stale = [name for name in required_fields if name in fields and name not in fresh]
+        if stale:
+            logging.info(f"Metadata cache entry for {key} has expired fields {stale}; re-extracting.")
+            return None
+        logging.info(f"Metadata cache hit for {key}")
+        return copy.deepcopy(fresh)
+
+    def put(self, key, info):
+        """Stores an info dict, stamping each field with its own expiry time."""
+        if not info:
+            return
+        now = time.time()
+        fields = {name: (now + field_ttl(name), copy.deepcopy(value)) for name, value in info.items()}
+        self._remember(key, fields)
+        self._db_put(key, fields)
+
+    def invalidate(self, key):
+        """Forgets key in every tier, e.g. after its media URLs turned out to be dead."""
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._db is not None:
+            with self._lock:
+                try:
+                    self._db.execute('DELETE FROM metadata WHERE key = ?', (key,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"Metadata cache delete failed for {key}: {e}")
+
+    def _remember(self, key, fields):
+        with self._lock:
+            self._memory[key] = fields
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _open_db(self):
+        try:
+            self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'key TEXT PRIMARY KEY, fields TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Could not open metadata cache database {self.db_path}, using memory only: {e}")
+            self._db = None
+
+    def _db_get(self, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    'SELECT fields FROM metadata WHERE key = ? AND expires_at > ?', (key, time.time())
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Metadata cache lookup failed for {key}: {e}")
+                return None
+        if not row:
+            return None
+        return {name: tuple(pair) for name, pair in json.loads(row[0]).items()}
+
+    def _db_put(self, key, fields):
+        if self._db is None:
+            return
+        try:
+            payload = json.dumps(fields)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Metadata for {key} is not serializable, keeping it in memory only: {e}")
+            return
+        expires_at = max(expires for expires, _ in fields.values())
+        with self._lock:
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO metadata (key, fields, expires_at) VALUES (?, ?, ?)',
+                    (key, payload, expires_at)
+                )
+                # Opportunistically drop rows that can never be served again
+                self._db.execute('DELETE FROM metadata WHERE expires_at <= ?', (time.time(),))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Metadata cache write failed for {key}: {e}")
+
+
+metadata_cache = MetadataCache()
+
+
+def cached_extract_info(ydl, url, key):
+    """
+    Drop-in for ydl.extract_info(url, download=False) that consults the
+    shared metadata cache first. Extraction errors propagate unchanged.
+    """
+    info = metadata_cache.get(key)
+    if info:
+        return info
+    info = ydl.extract_info(url, download=False)
+    if info:
+        metadata_cache.put(key, ydl.sanitize_info(info))
+    return info
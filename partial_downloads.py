@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from result_cache import ARTIFACT_DIR, make_cache_key
+from single_flight import file_lock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+# Interrupted downloads stay here, one directory per media item, so a retry can resume them
+PARTIAL_DIR = os.environ.get('PARTIAL_DIR', os.path.join(ARTIFACT_DIR, '.partials'))
+PARTIAL_TTL_SECONDS = int(os.environ.get('PARTIAL_TTL_SECONDS', 24 * 3600))  # Abandoned areas are removed after this
+MANIFEST_NAME = '.manifest.json'
+
+
+@contextmanager
+def partial_area(*key_parts):
+    """
+    Yields a persistent download directory for one media item (e.g.
+    'twitter', tweet_id). It survives failures and restarts so the next
+    attempt resumes what is already there; call discard_area() once the
+    item has been delivered. Held under a cross-process lock.
+    """
+    name = make_cache_key(*key_parts)[:32]
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    with file_lock(PARTIAL_DIR, name):
+        _prune_stale(skip=name)
+        path = os.path.join(PARTIAL_DIR, name)
+        if os.path.isdir(path):
+            logging.info(f"Reusing partial download area for {key_parts}")
+            os.utime(path)  # Keeps it off the stale list while in use
+        else:
+            os.makedirs(path)
+        yield path
+
+
+def discard_area(path):
+    """Removes a partial area once its media has been turned into an artifact."""
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def formats_fingerprint(info):
+    """
+    Identifies the exact media streams an info dict describes (format IDs
+    and sizes, including playlist entries). Partial data is only reused
+    while this stays the same, so a resume never appends different bytes.
+    """
+    def streams(entry):
+        return [(f.get('format_id'), f.get('ext'), f.get('filesize') or f.get('filesize_approx'))
+                for f in entry.get('formats') or []]
+
+    parts = [info.get('id'), streams(info)]
+    for entry in info.get('entries') or []:
+        if entry:
+            parts.append((entry.get('id'), streams(entry)))
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def check_manifest(directory, fingerprint):
+    """
+    Clears directory if it holds partial data for a different fingerprint,
+    then records the current one. Returns True if existing data may be reused.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f).get('fingerprint')
+    except (OSError, ValueError):
+        previous = None
+    if previous and previous != fingerprint:
+        logging.warning(f"Source media changed since the last attempt; discarding partial data in {directory}")
+        for entry in os.scandir(directory):
+            try:
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+    with open(manifest_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'updated': time.time()}, f)
+    return previous == fingerprint
+
+
+def _prune_stale(skip=None):
+    # Only the partial area is listed here, and it holds one entry per unfinished item
+    cutoff = time.time() - PARTIAL_TTL_SECONDS
+    for entry in os.scandir(PARTIAL_DIR):
+        if entry.name == skip or not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                logging.info(f"Removing abandoned partial downloads in {entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
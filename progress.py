@@ -0,0 +1,145 @@
+import os
+import uuid
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+FFMPEG_PROGRESS_POLL_SECONDS = 0.5  # How often an ffmpeg -progress file is read for new lines
+
+# Callback that receives progress fields for the job running in this context
+_reporter = contextvars.ContextVar('progress_reporter', default=None)
+# File the current process's ffmpeg runs should write -progress output to
+_ffmpeg_target = contextvars.ContextVar('ffmpeg_progress_target', default=None)
+
+
+@contextmanager
+def reporting_to(callback):
+    """Routes report() calls made in this context to callback(**fields)."""
+    token = _reporter.set(callback)
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
+
+
+def report(**fields):
+    """Publishes progress fields for the current job; a no-op outside a job."""
+    callback = _reporter.get()
+    if callback:
+        try:
+            callback(**fields)
+        except Exception as e:
+            logging.debug(f"Progress callback failed: {e}")
+
+
+def ytdlp_progress_hook():
+    """
+    A yt-dlp progress hook reporting download bytes, speed and ETA. It is
+    bound to the current job here, because yt-dlp may call it from its own
+    fragment-download threads.
+    """
+    callback = _reporter.get()
+
+    def hook(d):
+        if not callback or d.get('status') not in ('downloading', 'finished'):
+            return
+        fields = {'downloadedBytes': d.get('downloaded_bytes')}
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if total:
+            fields['totalBytes'] = int(total)
+        if d.get('speed'):
+            fields['speed'] = round(d['speed'])
+        if d.get('eta') is not None:
+            fields['eta'] = d['eta']
+        try:
+            callback(**fields)
+        except Exception as e:
+            logging.debug(f"Progress callback failed: {e}")
+
+    return hook
+
+
+def ffmpeg_progress_args():
+    """ffmpeg global options that write machine-readable progress for the current job, if any."""
+    target = _ffmpeg_target.get()
+    return ['-progress', target, '-nostats'] if target else []
+
+
+def call_with_ffmpeg_target(target, func, args, kwargs):
+    """Runs func in a conversion worker with its ffmpeg progress going to target."""
+    token = _ffmpeg_target.set(target)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _ffmpeg_target.reset(token)  # Pool workers are reused across jobs
+
+
+@contextmanager
+def tail_ffmpeg_progress():
+    """
+    While a job is reporting, gives its ffmpeg runs a progress file and
+    tails it from a background thread, forwarding frame counts and encoded
+    time. Yields the file path, or None when nobody is listening.
+    """
+    callback = _reporter.get()
+    if not callback:
+        yield None
+        return
+    path = os.path.join(tempfile.gettempdir(), f"ffmpeg-progress-{uuid.uuid4().hex}.txt")
+    stop = threading.Event()
+    thread = threading.Thread(target=_tail, args=(path, callback, stop), name='ffmpeg-progress', daemon=True)
+    token = _ffmpeg_target.set(path)
+    thread.start()
+    try:
+        yield path
+    finally:
+        _ffmpeg_target.reset(token)
+        stop.set()
+        thread.join()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _tail(path, callback, stop):
+    offset, pending, block = 0, '', {}
+    while True:
+        stopping = stop.wait(FFMPEG_PROGRESS_POLL_SECONDS)
+        try:
+            if os.path.getsize(path) < offset:
+                offset, pending, block = 0, '', {}  # A new ffmpeg run truncated the file
+            with open(path, 'r') as f:
+                f.seek(offset)
+                pending += f.read()
+                offset = f.tell()
+        except OSError:
+            pass  # ffmpeg hasn't created it yet
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                block[key] = value
+                continue
+            # 'progress=continue|end' closes one report block
+            fields = {}
+            if block.get('frame', '').isdigit():
+                fields['frames'] = int(block['frame'])
+            if block.get('out_time_us', '').isdigit():
+                fields['encodedSeconds'] = round(int(block['out_time_us']) / 1e6, 2)
+            if block.get('speed', 'N/A') != 'N/A':
+                fields['encodeSpeed'] = block['speed'].strip()
+            if fields:
+                try:
+                    callback(**fields)
+                except Exception as e:
+                    logging.debug(f"Progress callback failed: {e}")
+            block = {}
+        if stopping:
+            return
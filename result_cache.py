@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from single_flight import file_lock
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+# Where finished artifacts are published and served from, separate from the code
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GiB
+RESULT_CACHE_INDEX_NAME = '.result_cache_index.json'
+ARTIFACT_TTL_SECONDS = int(os.environ.get('ARTIFACT_TTL_SECONDS', 7 * 24 * 3600))  # Since last access
+# Recently served artifacts are never removed, so range requests and proxy-offloaded transfers can finish
+ARTIFACT_GRACE_SECONDS = int(os.environ.get('ARTIFACT_GRACE_SECONDS', 600))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get('JANITOR_INTERVAL_SECONDS', 300))
+
+
+def make_cache_key(*parts):
+    """Builds a stable content address from the parameters that determine an artifact."""
+    raw = json.dumps([str(p) for p in parts])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Tracks finished artifacts in a directory, keyed on the parameters that
+    produced them. Keeps a small JSON index of size, last access and hit
+    count, and evicts least-recently-used entries once the disk budget is exceeded.
+
+    The index is the store's only inventory: it is updated as artifacts are
+    published and served, so the janitor never has to rescan the directory.
+    It is shared between server processes under a file lock.
+    """
+
+    def __init__(self, directory, max_bytes=RESULT_CACHE_MAX_BYTES, ttl_seconds=ARTIFACT_TTL_SECONDS,
+                 grace_seconds=ARTIFACT_GRACE_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self.index_path = os.path.join(directory, RESULT_CACHE_INDEX_NAME)
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_stamp = None  # (mtime_ns, size) of the index file as last loaded
+
+    @contextmanager
+    def _locked(self):
+        """Holds the index for update, picking up changes other processes saved."""
+        with self._lock, file_lock(self.directory, RESULT_CACHE_INDEX_NAME):
+            stamp = self._stat_index()
+            if stamp != self._index_stamp:
+                self._index = self._load_index()
+                self._index_stamp = stamp
+            yield
+
+    def get(self, key):
+        """Returns the cached artifact path for key, or None on a miss."""
+        with self._locked():
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            path = os.path.join(self.directory, entry['filename'])
+            if not os.path.exists(path):
+                # Artifact was removed behind our back; forget it
+                del self._index[key]
+                self._save_index()
+                return None
+            entry['last_access'] = time.time()
+            entry['hits'] += 1
+            self._save_index()
+        logging.info(f"Result cache hit for {entry['filename']} ({entry['hits']} hits)")
+        return path
+
+    def put(self, key, path):
+        """Registers a finished artifact under key and enforces the disk budget."""
+        if not path or not os.path.exists(path):
+            return
+        with self._locked():
+            self._index[key] = {
+                'filename': os.path.basename(path),
+                'size': os.path.getsize(path),
+                'last_access': time.time(),
+                'hits': 0,
+            }
+            self._evict(keep=key)
+            self._save_index()
+
+    def touch(self, filename):
+        """Marks an artifact as just served, protecting it from the janitor for the grace period."""
+        with self._locked():
+            for entry in self._index.values():
+                if entry['filename'] == filename:
+                    entry['last_access'] = time.time()
+                    self._save_index()
+                    return
+
+    def sweep(self):
+        """Removes artifacts past their TTL, then least-recently-used ones over the size budget."""
+        with self._locked():
+            removed = self._evict(expire_before=time.time() - self.ttl_seconds)
+            if removed:
+                self._save_index()
+        return removed
+
+    def total_bytes(self):
+        """Returns the total size of all indexed artifacts."""
+        with self._locked():
+            return sum(entry['size'] for entry in self._index.values())
+
+    def _evict(self, keep=None, expire_before=None):
+        total = sum(entry['size'] for entry in self._index.values())
+        protect_after = time.time() - self.grace_seconds
+        removed = 0
+        # Oldest access first
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]['last_access']):
+            expired = expire_before is not None and entry['last_access'] < expire_before
+            if total <= self.max_bytes and not expired:
+                break
+            if key == keep or entry['last_access'] > protect_after:
+                continue
+            path = os.path.join(self.directory, entry['filename'])
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                logging.info(f"Result cache evicted {entry['filename']} ({entry['size']} bytes)")
+            except OSError as e:
+                logging.warning(f"Could not evict cached artifact {path}: {e}")
+                continue
+            total -= entry['size']
+            removed += 1
+            del self._index[key]
+        return removed
+
+    def _stat_index(self):
+        try:
+            st = os.stat(self.index_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read result cache index {self.index_path}, starting empty: {e}")
+            return {}
+
+    def _save_index(self):
+        # Write to a temp file and swap it in so readers never see a half-written index
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._index, f)
+            os.replace(tmp_path, self.index_path)
+            self._index_stamp = self._stat_index()
+        except OSError as e:
+            logging.warning(f"Could not write result cache index {self.index_path}: {e}")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_result_cache(directory):
+    """Returns the shared ResultCache for a directory, creating it on first use."""
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = ResultCache(directory)
+            _caches[directory] = cache
+        return cache
+
+
+def start_janitor(directory=ARTIFACT_DIR, interval=JANITOR_INTERVAL_SECONDS):
+    """Starts a daemon thread that sweeps the artifact store every `interval` seconds."""
+    cache = get_result_cache(directory)
+
+    def run():
+        while True:
+            try:
+                removed = cache.sweep()
+                if removed:
+                    logging.info(f"Janitor removed {removed} artifacts from {directory}")
+            except Exception as e:
+                logging.exception(f"Janitor sweep failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='artifact-janitor', daemon=True)
+    thread.start()
+    return thread
@@ -38,6 +38,104 @@ document.addEventListener('DOMContentLoaded', () => {
         logArea.scrollTop = logArea.scrollHeight; // Scroll to bottom
     }
 
+    // --- Helper Function to Turn a Job's Final Status Into the Old Response Shape ---
+    function jobOutcome(job) {
+        if (job.status === 'finished') {
+            return { ...job, status: 'Success' };
+        }
+        if (job.status === 'failed') {
+            return { status: 'Error', message: job.error };
+        }
+        return job;
+    }
+
+    // --- Helper Function to Describe a Progress Update in One Line ---
+    function describeProgress(progress) {
+        const parts = [progress.stage || 'working'];
+        if (progress.totalBytes && progress.downloadedBytes != null) {
+            parts.push(`${Math.floor(100 * progress.downloadedBytes / progress.totalBytes)}%`);
+        } else if (progress.downloadedBytes) {
+            parts.push(`${(progress.downloadedBytes / 1048576).toFixed(1)} MiB`);
+        }
+        if (progress.eta != null) {
+            parts.push(`ETA ${progress.eta}s`);
+        }
+        if (progress.frames != null) {
+            parts.push(`${progress.frames} frames`);
+        }
+        return parts.join(' - ');
+    }
+
+    // --- Helper Function to Follow a Job's Live Progress Over Server-Sent Events ---
+    // Logs stage changes and roughly one progress line every few seconds.
+    function followJobEvents(data, logArea) {
+        const eventsUrl = `http://99.234.26.185:5050${data.statusUrl}/events`;
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(eventsUrl);
+            let lastStage = null;
+            let lastLogged = 0;
+            source.addEventListener('progress', event => {
+                const update = JSON.parse(event.data);
+                const progress = update.progress || {};
+                const now = Date.now();
+                if (progress.stage !== lastStage || now - lastLogged > 3000) {
+                    addLogMessage(logArea, `Job ${update.status}: ${describeProgress(progress)}`);
+                    lastStage = progress.stage;
+                    lastLogged = now;
+                }
+            });
+            source.addEventListener('done', event => {
+                source.close();
+                resolve(jobOutcome(JSON.parse(event.data)));
+            });
+            source.onerror = () => {
+                // Server without /events, or the stream dropped for good: fall back to polling
+                if (source.readyState === EventSource.CLOSED) {
+                    reject(new Error('event stream closed'));
+                }
+            };
+        });
+    }
+
+    // --- Helper Function to Wait for a Queued Job Until It Finishes ---
+    // The backend answers /process-* with a jobId right away; this resolves
+    // with the same shape the old synchronous response had. Live progress
+    // comes over SSE where the browser supports it, otherwise the job is polled.
+    function waitForJob(data, logArea) {
+        if (!data.jobId) {
+            return Promise.resolve(data);
+        }
+        addLogMessage(logArea, `Job queued (${data.jobId}). Waiting for it to finish...`);
+        if (window.EventSource) {
+            return followJobEvents(data, logArea).catch(() => pollJob(data, logArea));
+        }
+        return pollJob(data, logArea);
+    }
+
+    function pollJob(data, logArea) {
+        const statusUrl = `http://99.234.26.185:5050${data.statusUrl}`;
+        return new Promise((resolve, reject) => {
+            let lastStatus = null;
+            const poll = () => {
+                fetch(statusUrl)
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.status !== lastStatus) {
+                            addLogMessage(logArea, `Job status: ${job.status}`);
+                            lastStatus = job.status;
+                        }
+                        if (['finished', 'failed', 'Error'].includes(job.status)) {
+                            resolve(jobOutcome(job));
+                        } else {
+                            setTimeout(poll, 2000);
+                        }
+                    })
+                    .catch(reject);
+            };
+            poll();
+        });
+    }
+
     // Add a server health check when the page loads
     checkServerAvailability();
     
@@ -113,6 +211,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
                 return response.json();
             })
+            .then(data => waitForJob(data, youtubeLog))
             .then(data => {
                 console.log('Response data:', data);
                 addLogMessage(youtubeLog, `Backend: ${data.status}`);
@@ -170,6 +269,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
                 return response.json(); // Parse JSON body on success
             })
+            .then(data => waitForJob(data, twitterLog))
             .then(data => {
                 addLogMessage(twitterLog, `Backend: ${data.status}`);
                 if (data.status === 'Success' && data.path) {
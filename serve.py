@@ -0,0 +1,123 @@
+"""
+Production entry point for the API server.
+
+Runs app.py under gunicorn with preforked workers, each serving requests
+on a thread pool. Conversions are budgeted across all workers, job status
+is shared between them, and on reload (SIGHUP) or shutdown (SIGTERM) each
+worker finishes its in-flight jobs before exiting.
+
+    python serve.py                      # WEB_WORKERS / WEB_THREADS / WEB_BIND from the environment
+    python serve.py --workers 4 --bind 0.0.0.0:8000
+"""
+import os
+import sys
+import logging
+import argparse
+
+# Not conversion_pool: importing it here would size its pool before budget_worker_env
+# runs, and the forked workers would inherit that unbudgeted pool
+from cpu_info import available_cpus
+from result_cache import ARTIFACT_DIR
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.workers.gthread import ThreadWorker
+    GUNICORN_AVAILABLE = True
+except ImportError:  # gunicorn is POSIX-only
+    GUNICORN_AVAILABLE = False
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+WEB_BIND = os.environ.get('WEB_BIND', '127.0.0.1:5000')
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', min(4, available_cpus())))  # Server processes
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))  # Request threads per process
+# Handlers only queue jobs, poll status or stream files, so this bounds a stuck worker, not a conversion
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 60))
+WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', 5))
+# How long a stopping worker may spend finishing its jobs; sized for a slow download plus size-targeted encode
+DRAIN_TIMEOUT_SECONDS = int(os.environ.get('DRAIN_TIMEOUT_SECONDS', 300))
+
+
+def budget_worker_env(workers):
+    """
+    Splits the CPU-bound budgets across server processes, so `workers`
+    processes together run about one conversion per two CPUs and one
+    ffmpeg thread per CPU. Explicit environment settings win.
+    """
+    cpus = available_cpus()
+    conversions = max(1, cpus // 2 // workers)
+    os.environ.setdefault('CONVERSION_WORKERS', str(conversions))
+    os.environ.setdefault('FFMPEG_THREADS', str(max(1, cpus // (workers * int(os.environ['CONVERSION_WORKERS'])))))
+    # Any worker may receive a status poll for a job another worker is running
+    os.environ.setdefault('JOB_STATE_DIR', os.path.join(ARTIFACT_DIR, '.jobs'))
+
+
+def drain_worker(worker):
+    """
+    Drains a stopping worker's jobs while keeping its heartbeat alive.
+    Must run inside the worker before it returns: gunicorn closes the
+    heartbeat file before calling worker_exit, so a drain there would be
+    killed as a hung worker after WEB_TIMEOUT.
+    """
+    app_module = sys.modules.get('app')
+    if app_module is None:
+        return
+    # Otherwise the arbiter treats a long drain as a hung worker and kills it
+    app_module.drain(DRAIN_TIMEOUT_SECONDS, heartbeat=worker.notify)
+
+
+if GUNICORN_AVAILABLE:
+    class DrainingThreadWorker(ThreadWorker):
+        """gthread worker that finishes its jobs after it stops accepting requests."""
+
+        def run(self):
+            super().run()
+            drain_worker(self)
+
+    class ServerApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the API server with multiple worker processes.')
+    parser.add_argument('--bind', default=WEB_BIND, help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=WEB_WORKERS, help='Server processes')
+    parser.add_argument('--threads', type=int, default=WEB_THREADS, help='Request threads per process')
+    parser.add_argument('--timeout', type=int, default=WEB_TIMEOUT, help='Seconds before a silent worker is restarted')
+    args = parser.parse_args()
+
+    if not GUNICORN_AVAILABLE:
+        logging.error("gunicorn is not installed (pip install gunicorn). Use 'python app.py' for local development.")
+        sys.exit(1)
+
+    budget_worker_env(args.workers)
+    logging.info(f"Serving on {args.bind} with {args.workers} workers x {args.threads} threads, "
+                 f"{os.environ['CONVERSION_WORKERS']} conversions per worker")
+    ServerApplication({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': DrainingThreadWorker,
+        'timeout': args.timeout,
+        'keepalive': WEB_KEEPALIVE,
+        # The arbiter waits this long after SIGTERM/SIGHUP before killing workers
+        'graceful_timeout': DRAIN_TIMEOUT_SECONDS + 10,
+        # Each worker imports the app itself: its job threads and spawned pools must not cross a fork
+        'preload_app': False,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:  # Windows: fall back to in-process coalescing only
+    FCNTL_AVAILABLE = False
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+LOCK_DIR_NAME = '.locks'
+PARTIAL_MARKER = '.partial-'  # Files being written carry this in their name until published
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    work, later callers with the same key wait for and share its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) unless a call for key is already in flight."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            logging.info(f"Joining in-flight work for {key}")
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self):
+        """Returns the number of keys currently being worked on."""
+        with self._lock:
+            return len(self._calls)
+
+
+@contextmanager
+def file_lock(directory, key):
+    """
+    Cross-process exclusive lock for key, so worker processes that each
+    passed SingleFlight still produce a given artifact only once.
+    """
+    if not FCNTL_AVAILABLE:
+        yield
+        return
+    lock_dir = os.path.join(directory, LOCK_DIR_NAME)
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_path = os.path.join(lock_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock')
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def partial_path(final_path):
+    """
+    A unique sibling path to write into before publishing. It keeps the
+    extension, so tools that infer the format from the name still work.
+    """
+    root, ext = os.path.splitext(final_path)
+    return f"{root}{PARTIAL_MARKER}{uuid.uuid4().hex[:8]}{ext}"
+
+
+def publish(partial, final_path):
+    """Atomically moves a finished file into place; readers never see it half-written."""
+    os.replace(partial, final_path)
+    return final_path
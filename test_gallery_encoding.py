@@ -0,0 +1,101 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+pipeline = pytest.importorskip('TwitterLinktoGIF')
+
+needs_ffmpeg = pytest.mark.skipif(not shutil.which('ffmpeg'), reason='ffmpeg not installed')
+
+COLORS = [(220, 40, 40), (40, 200, 60), (40, 80, 220), (230, 200, 40), (160, 40, 200), (40, 200, 200), (250, 250, 250)]
+
+
+def make_gallery(directory, count):
+    """Distinct solid images of mixed sizes and formats, like a real gallery."""
+    paths = []
+    for i in range(count):
+        ext = '.jpg' if i % 2 else '.png'
+        path = os.path.join(directory, f"temp_media_1_{i + 1}{ext}")
+        Image.new('RGB', (320 + 40 * i, 240), COLORS[i % len(COLORS)]).save(path)
+        paths.append(path)
+    return paths
+
+
+def count_frames(path):
+    """Frames in an animation; GIF, WebP and APNG are read with PIL, so ffprobe isn't needed."""
+    if not path.endswith('.mp4'):
+        with Image.open(path) as img:
+            return getattr(img, 'n_frames', 1)
+    # One framemd5 line per decoded frame
+    out = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-map', '0:v', '-f', 'framemd5', '-'],
+                         check=True, capture_output=True, text=True).stdout
+    return sum(1 for line in out.splitlines() if line and not line.startswith('#'))
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('count', [3, 5, 7])
+def test_every_gallery_image_becomes_a_frame(tmp_path, count):
+    paths = make_gallery(str(tmp_path), count)
+    gif_path = str(tmp_path / 'out.gif')
+    assert pipeline.convert_images_to_gif_ffmpeg(list(reversed(paths)), gif_path, two_pass=False) == gif_path
+    assert count_frames(gif_path) == count
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('count', [3, 7])
+def test_two_pass_gallery_keeps_every_frame(tmp_path, count):
+    paths = make_gallery(str(tmp_path), count)
+    gif_path = str(tmp_path / 'out.gif')
+    assert pipeline.convert_images_to_gif_ffmpeg(paths, gif_path, two_pass=True) == gif_path
+    assert count_frames(gif_path) == count
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('output_format', ['webp', 'mp4', 'apng'])
+@pytest.mark.parametrize('count', [2, 3, 7])
+def test_every_gallery_image_becomes_a_frame_in_other_formats(tmp_path, output_format, count):
+    paths = make_gallery(str(tmp_path), count)
+    out_path = str(tmp_path / f"out{pipeline.OUTPUT_FORMATS[output_format]}")
+    assert pipeline.convert_to_format_ffmpeg(paths, out_path, output_format, images=True) == out_path
+    assert count_frames(out_path) == count
+
+
+@needs_ffmpeg
+def test_odd_widths_encode_to_mp4(tmp_path):
+    video_path = str(tmp_path / 'in.mp4')
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate=15:duration=1',
+                    '-pix_fmt', 'yuv420p', '-y', video_path], check=True, capture_output=True)
+    out_path = str(tmp_path / 'out.mp4')
+    assert pipeline.convert_to_format_ffmpeg([video_path], out_path, 'mp4', fps=15, width=241) == out_path
+
+
+def test_durations_follow_their_images_when_sorted(tmp_path):
+    paths = make_gallery(str(tmp_path), 3)
+    # Out of order on purpose: each duration must stay with its own image
+    shuffled = [paths[2], paths[0], paths[1]]
+    input_args, filters = pipeline.image_sequence_graph(shuffled, durations=[0.3, 0.1, 0.2])
+    assert input_args[1::2] == paths
+    chains = filters.split(';')
+    # Two clones per 0.1 s output frame
+    for chain, clones in zip(chains, [2, 4, 6]):
+        assert f"loop=loop={clones - 1}:" in chain
+
+
+@needs_ffmpeg
+def test_per_image_durations_set_the_frame_count(tmp_path):
+    paths = make_gallery(str(tmp_path), 3)
+    gif_path = str(tmp_path / 'out.gif')
+    assert pipeline.convert_images_to_gif_ffmpeg(paths, gif_path, two_pass=False, durations=[0.3, 0.1, 0.2]) == gif_path
+    with Image.open(gif_path) as img:
+        total_ms = sum((img.seek(i), img.info['duration'])[1] for i in range(img.n_frames))
+    assert total_ms == 600
+
+
+def test_pil_frames_fit_the_box_without_upscaling(tmp_path):
+    portrait, small = str(tmp_path / 'portrait.png'), str(tmp_path / 'small.png')
+    Image.new('RGB', (400, 900), (10, 20, 30)).save(portrait)
+    Image.new('RGB', (200, 100), (30, 20, 10)).save(small)
+    assert next(pipeline.iter_gif_frames([portrait], width=640)).size == (284, 640)
+    assert next(pipeline.iter_gif_frames([small], width=640)).size == (200, 100)
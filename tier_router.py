@@ -0,0 +1,132 @@
+import os
+import time
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Constants ---
+ROUTER_DECAY = float(os.environ.get('ROUTER_DECAY', 0.2))  # Weight of the newest attempt in the moving averages
+ROUTER_SKIP_AFTER_FAILURES = int(os.environ.get('ROUTER_SKIP_AFTER_FAILURES', 3))  # Consecutive failures before skipping
+ROUTER_PROBE_SECONDS = int(os.environ.get('ROUTER_PROBE_SECONDS', 300))  # A skipped tier is retried this often
+ANY_CLASS = 'any'  # Pooled stats across classes, used until a class has history of its own
+
+
+class TierStats:
+    """Moving success rate and latency for one tier within one content class."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.success_rate = 1.0  # Optimistic until proven otherwise, so every tier gets tried
+        self.latency = None
+        self.consecutive_failures = 0
+        self.last_attempt = 0.0
+        self.errors = {}  # error signature -> count
+
+    def record(self, succeeded, seconds, error=None):
+        self.attempts += 1
+        self.last_attempt = time.monotonic()
+        self.success_rate += ROUTER_DECAY * ((1.0 if succeeded else 0.0) - self.success_rate)
+        self.latency = seconds if self.latency is None else self.latency + ROUTER_DECAY * (seconds - self.latency)
+        if succeeded:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            signature = error or 'no_result'
+            self.errors[signature] = self.errors.get(signature, 0) + 1
+
+    def failing(self):
+        return self.consecutive_failures >= ROUTER_SKIP_AFTER_FAILURES
+
+    def expected_cost(self):
+        """Seconds spent per success: cheap, reliable tiers sort first."""
+        return (self.latency or 0.0) / max(self.success_rate, 0.01)
+
+    def to_dict(self):
+        return {
+            'attempts': self.attempts,
+            'successRate': round(self.success_rate, 3),
+            'latencySeconds': round(self.latency, 3) if self.latency is not None else None,
+            'consecutiveFailures': self.consecutive_failures,
+            'errors': dict(self.errors),
+        }
+
+
+class TierRouter:
+    """
+    Orders fallback tiers per content class (e.g. 'image@x.com') by how
+    likely and how quickly each has succeeded lately. Tiers that keep
+    failing for a class are skipped, except for one probe every
+    ROUTER_PROBE_SECONDS so they come back once they work again. Classes
+    without history of their own are ordered by the pooled stats but
+    never skip a tier on them. Tiers that have never been tried keep
+    their default position; only tried tiers trade places by cost.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._stats = {}  # (content class, tier) -> TierStats
+        self._lock = threading.Lock()
+
+    def plan(self, content_class, tiers):
+        """
+        Returns the tiers to try, in order. tiers is the default order,
+        which breaks ties. At least one tier is returned whenever tiers
+        is not empty.
+        """
+        now = time.monotonic()
+        with self._lock:
+            probes, slots, ranked, skipped = [], [], [], []
+            for position, tier in enumerate(tiers):
+                stats, pooled = self._stats_for(content_class, tier)
+                if not pooled and stats.failing() and now - stats.last_attempt < ROUTER_PROBE_SECONDS:
+                    skipped.append((-stats.success_rate, stats.expected_cost(), position, tier))
+                    continue
+                if not pooled and stats.failing():
+                    # Probe first, so the attempt actually happens; claiming the slot now
+                    # keeps concurrent requests from all probing at once
+                    stats.last_attempt = now
+                    logging.info(f"{self.name}: probing failing tier '{tier}' for {content_class}")
+                    probes.append(tier)
+                    continue
+                slots.append(tier)
+                if stats.attempts:
+                    ranked.append((stats.expected_cost(), position, tier))
+        # Tried tiers are reordered among the slots they occupy; untried ones stay put
+        by_cost = iter(tier for _, _, tier in sorted(ranked))
+        tried = {tier for _, _, tier in ranked}
+        order = probes + [next(by_cost) if tier in tried else tier for tier in slots]
+        if order and skipped:
+            logging.info(f"{self.name}: skipping failing tiers {[tier for *_, tier in skipped]} for {content_class}")
+        if not order and skipped:
+            # Every tier is failing for this class; still try the one with the best record
+            *_, best = min(skipped)
+            logging.warning(f"{self.name}: every tier is failing for {content_class}; "
+                            f"trying '{best}', which has the best recent success rate")
+            order = [best]
+        return order
+
+    def record(self, content_class, tier, succeeded, seconds, error=None):
+        """Records one attempt under its class and in the pooled stats."""
+        with self._lock:
+            for key in {(content_class, tier), (ANY_CLASS, tier)}:
+                stats = self._stats.get(key)
+                if stats is None:
+                    stats = self._stats[key] = TierStats()
+                stats.record(succeeded, seconds, error)
+
+    def snapshot(self):
+        """Returns {content class: {tier: stats dict}} for reporting."""
+        with self._lock:
+            result = {}
+            for (content_class, tier), stats in self._stats.items():
+                result.setdefault(content_class, {})[tier] = stats.to_dict()
+            return result
+
+    def _stats_for(self, content_class, tier):
+        """Returns (stats, pooled): a class with no history for a tier borrows the pooled numbers."""
+        stats = self._stats.get((content_class, tier))
+        if stats is not None:
+            return stats, False
+        return self._stats.get((ANY_CLASS, tier)) or TierStats(), True